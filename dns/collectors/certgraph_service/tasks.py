@@ -14,6 +14,9 @@ from celery import Celery
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 MONGO_URI = os.environ.get("MONGO_URI")
 
+# Estados DNS (los fija main en dominios_pendientes) de dominios que no se analizan
+ESTADOS_DNS_MUERTOS = ["nxdomain", "servfail", "sin_delegacion"]
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, 
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -213,9 +216,22 @@ def worker_loop():
             
             # Buscar dominio pendiente
             dominio_doc = col_pendientes.find_one_and_update(
-                {"procesado_por.certgraph": False, "procesado_por.certgraph_iniciado": {"$exists": False}},
+                {
+                    "procesado_por.certgraph": False,
+                    "procesado_por.certgraph_iniciado": {"$exists": False},
+                    # Agotados los reintentos (dead-letter): fuera hasta revisión manual
+                    "procesado_por.certgraph_dead_letter": {"$exists": False},
+                    # Dominios sin zona DNS según la comprobación previa de main
+                    "estado_dns": {"$nin": ESTADOS_DNS_MUERTOS},
+                    # Dominios devueltos por el recolector de leases esperan a su próximo intento
+                    "$or": [
+                        {"procesado_por.certgraph_proximo_intento": {"$exists": False}},
+                        {"procesado_por.certgraph_proximo_intento": {"$lte": datetime.now(timezone.utc)}}
+                    ]
+                },
                 {"$set": {"procesado_por.certgraph_iniciado": datetime.now(timezone.utc)}},
-                sort=[("_id", 1)]
+                # Nunca escaneados primero; después las revisitas más atrasadas
+                sort=[("procesado_por.certgraph_next_scan_at", 1), ("_id", 1)]
             )
             
             # Si encontramos un dominio, procesarlo
@@ -9,6 +9,8 @@ import requests
 from pymongo import MongoClient
 from celery import Celery
 
+from circuito import Circuito, CIRCUITO_COMPARTIDO
+
 # Configuración
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 MONGO_URI = os.environ.get("MONGO_URI")
@@ -35,6 +37,20 @@ def get_mongo_db():
     client = MongoClient(MONGO_URI)
     return client, client["dominios_db"]
 
+# Conexión persistente para el estado compartido del cortocircuito
+_mongo_circuitos = None
+
+def get_col_circuitos():
+    global _mongo_circuitos
+    if _mongo_circuitos is None:
+        _mongo_circuitos = MongoClient(MONGO_URI)
+    return _mongo_circuitos["dominios_db"]["circuitos"]
+
+# Si OpenData falla o limita (429), se deja de llamar hasta que una sonda vaya bien
+circuito_opendata = Circuito("opendata", get_col_circuitos if CIRCUITO_COMPARTIDO else None)
+# Espera por defecto ante un 429 sin Retry-After
+OPENDATA_ESPERA_429_SEGUNDOS = float(os.environ.get("OPENDATA_ESPERA_429_SEGUNDOS", "60"))
+
 @app.task(bind=True, max_retries=3, default_retry_delay=60)
 def obtener_info_empresa_task(self, term: str, dominio: str = None):
     """Tarea Celery para obtener información de empresas"""
@@ -42,7 +58,8 @@ def obtener_info_empresa_task(self, term: str, dominio: str = None):
         resultado = obtener_info_empresa(term)
         
         # Si se especificó un dominio, guardar directamente el resultado
-        if dominio:
+        # (los fallos del servicio no se guardan: el dominio se reintenta más tarde)
+        if dominio and not resultado.get("reintentar"):
             procesar_y_guardar(dominio, term, resultado)
         
         return resultado
@@ -61,6 +78,8 @@ def procesar_dominio_empresa(dominio: str, term: str):
     
     try:
         resultado = obtener_info_empresa(term)
+        if resultado.get("reintentar"):
+            return {"dominio": dominio, "estado": "pospuesto", "error": resultado.get("error")}
         procesar_y_guardar(dominio, term, resultado)
         return {"dominio": dominio, "estado": "completado"}
     except Exception as e:
@@ -123,8 +142,23 @@ def procesar_y_guardar(dominio: str, term: str, resultado: dict):
     except Exception as e:
         logger.error(f"Error guardando información de empresa para {dominio}: {str(e)}")
 
+def _espera_429(error) -> float:
+    """Segundos de Retry-After de una respuesta 429 (o la espera por defecto)"""
+    respuesta = getattr(error, "response", None)
+    try:
+        return float(respuesta.headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return OPENDATA_ESPERA_429_SEGUNDOS
+
 def obtener_info_empresa(term: str) -> dict:
-    """Obtiene información de empresas desde el OpenData de Registradores"""
+    """
+    Obtiene información de empresas desde el OpenData de Registradores.
+    Con el circuito abierto o ante un fallo del servicio devuelve
+    {"error", "data": [], "reintentar": True} sin esperar.
+    """
+    if not circuito_opendata.permitir():
+        return {"error": "OpenData en pausa (circuito abierto)", "data": [], "reintentar": True}
+
     logger.info(f"Consultando OpenData para: '{term}'")
     
     # URL y parámetros
@@ -181,6 +215,7 @@ def obtener_info_empresa(term: str) -> dict:
             timeout=30  
         )
         resp.raise_for_status()
+        circuito_opendata.exito()
         
         # Buscar patrones de JSON en la respuesta
         content_type = resp.headers.get('Content-Type', '')
@@ -222,11 +257,13 @@ def obtener_info_empresa(term: str) -> dict:
         
     except requests.exceptions.RequestException as e:
         if "429" in str(e):
-            logger.warning(f"Rate limit excedido, esperando 60 segundos antes de reintentar...")
-            time.sleep(60)
+            logger.warning("Rate limit excedido, OpenData en pausa")
+            circuito_opendata.abrir(_espera_429(e), str(e))
+        else:
+            circuito_opendata.fallo(str(e))
         
         logger.error(f"Error de conexión: {str(e)}")
-        return {"error": str(e), "data": []}
+        return {"error": str(e), "data": [], "reintentar": True}
     except Exception as e:
         logger.error(f"Error inesperado: {str(e)}")
         return {"error": str(e), "data": []}
@@ -237,6 +274,10 @@ def worker_loop():
     logger.info("🚀 Iniciando worker loop del servicio OpenData")
     
     while True:
+        # Con el circuito abierto no se reclaman dominios
+        if not circuito_opendata.disponible():
+            time.sleep(min(30, max(1, circuito_opendata.segundos_para_sonda())))
+            continue
         try:
             # Crear conexión local a MongoDB
             client, db = get_mongo_db()
@@ -247,13 +288,23 @@ def worker_loop():
                 {
                     "procesado_por.opendata": {"$ne": True}, 
                     "procesado_por.opendata_iniciado": {"$exists": False},
-                    "$or": [
-                        {"titular": {"$exists": True, "$ne": ""}},
-                        {"identificacion": {"$exists": True, "$ne": ""}}
+                    # Agotados los reintentos (dead-letter): fuera hasta revisión manual
+                    "procesado_por.opendata_dead_letter": {"$exists": False},
+                    "$and": [
+                        {"$or": [
+                            {"titular": {"$exists": True, "$ne": ""}},
+                            {"identificacion": {"$exists": True, "$ne": ""}}
+                        ]},
+                        # Dominios devueltos por el recolector de leases esperan a su próximo intento
+                        {"$or": [
+                            {"procesado_por.opendata_proximo_intento": {"$exists": False}},
+                            {"procesado_por.opendata_proximo_intento": {"$lte": datetime.now(timezone.utc)}}
+                        ]}
                     ]
                 },
                 {"$set": {"procesado_por.opendata_iniciado": datetime.now(timezone.utc)}},
-                sort=[("_id", 1)]
+                # Nunca escaneados primero; después las revisitas más atrasadas
+                sort=[("procesado_por.opendata_next_scan_at", 1), ("_id", 1)]
             )
             
             if dominio_doc:
@@ -266,7 +317,17 @@ def worker_loop():
                     logger.info(f"Procesando dominio con OpenData: {dominio} (término: {term})")
                     try:
                         resultado = obtener_info_empresa(term)
-                        procesar_y_guardar(dominio, term, resultado)
+                        if resultado.get("reintentar"):
+                            # Fallo del servicio: se suelta el dominio para otra pasada
+                            espera = max(60, circuito_opendata.segundos_para_sonda())
+                            col_pendientes.update_one(
+                                {"dominio": dominio},
+                                {"$unset": {"procesado_por.opendata_iniciado": ""},
+                                 "$set": {"procesado_por.opendata_proximo_intento":
+                                          datetime.now(timezone.utc) + timedelta(seconds=espera)}}
+                            )
+                        else:
+                            procesar_y_guardar(dominio, term, resultado)
                     except Exception as e:
                         col_pendientes.update_one(
                             {"dominio": dominio},
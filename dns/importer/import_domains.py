@@ -2,6 +2,7 @@ import sys
 import re
 from pymongo import MongoClient
 import os
+import hashlib
 import logging
 
 # Configuración de logging
@@ -15,13 +16,34 @@ client = MongoClient(MONGO_URI)
 db = client["dominios_db"]
 dominios_pendientes = db["dominios_pendientes"]
 
-def import_domain(dominio, titular="", identificacion=""):
+# Partición para la reclamación particionada (misma función que main_service/particiones.py)
+PARTICIONES = int(os.environ.get("PARTICIONES", "256"))
+SUFIJOS_SEGUNDO_NIVEL = {
+    "com.es", "nom.es", "org.es", "gob.es", "edu.es",
+    "co.uk", "org.uk", "ac.uk", "gov.uk",
+    "com.ar", "com.br", "com.co", "com.mx", "com.pe", "com.uy", "com.ve", "com.au",
+}
+
+# Perfil de escaneo del lote (rapido, estandar, profundo); vacío = el de main por defecto
+IMPORT_PERFIL = os.environ.get("IMPORT_PERFIL", "")
+
+def clave_particion(dominio):
+    """Hash del dominio registrable módulo PARTICIONES"""
+    etiquetas = dominio.strip().lower().rstrip(".").split(".")
+    if len(etiquetas) >= 3 and ".".join(etiquetas[-2:]) in SUFIJOS_SEGUNDO_NIVEL:
+        registrable = ".".join(etiquetas[-3:])
+    else:
+        registrable = ".".join(etiquetas[-2:])
+    return int(hashlib.sha1(registrable.encode("utf-8")).hexdigest()[:8], 16) % PARTICIONES
+
+def import_domain(dominio, titular="", identificacion="", perfil=""):
     """Importar dominio a MongoDB en lugar de encolar tareas"""
     # Preparar documento
     documento = {
         "dominio": dominio,
         "titular": titular or "",  # Asegurar que no sea None
         "identificacion": identificacion or "",  # Asegurar que no sea None
+        "particion": clave_particion(dominio),
         "procesado_por": {
             "main": False,
             "lynx": False,
@@ -30,10 +52,13 @@ def import_domain(dominio, titular="", identificacion=""):
         }
     }
     
-    # Usar upsert para evitar duplicados
+    # Usar upsert para evitar duplicados; el perfil del lote se aplica también a los existentes
+    cambios = {"$setOnInsert": documento}
+    if perfil:
+        cambios["$set"] = {"perfil": perfil}
     result = dominios_pendientes.update_one(
         {"dominio": dominio}, 
-        {"$setOnInsert": documento}, 
+        cambios, 
         upsert=True
     )
     
@@ -44,7 +69,7 @@ def import_domain(dominio, titular="", identificacion=""):
         logger.info(f"Dominio ya existe: {dominio}")
         return False
 
-def importar_dominios_desde_archivo(path):
+def importar_dominios_desde_archivo(path, perfil=""):
     """Importar dominios desde RISP_OTROS.csv a MongoDB"""
     count_new = 0
     count_existing = 0
@@ -74,7 +99,7 @@ def importar_dominios_desde_archivo(path):
                 if not titular and not identificacion:
                     count_empty += 1
                 
-                if import_domain(dominio, titular, identificacion):
+                if import_domain(dominio, titular, identificacion, perfil):
                     count_new += 1
                 else:
                     count_existing += 1
@@ -86,5 +111,6 @@ def importar_dominios_desde_archivo(path):
 
 if __name__ == "__main__":
     filepath = sys.argv[1] if len(sys.argv) > 1 else "/app/RISP_OTROS.csv"
-    result = importar_dominios_desde_archivo(filepath)
+    perfil = sys.argv[2] if len(sys.argv) > 2 else IMPORT_PERFIL
+    result = importar_dominios_desde_archivo(filepath, perfil)
     print(result)
\ No newline at end of file
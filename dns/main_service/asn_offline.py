@@ -0,0 +1,176 @@
+import os
+import gzip
+import socket
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Tabla ASN offline (prefix-to-AS, coincidencia del prefijo más largo)
+# -------------------------------------------------------------------
+# Formato pfx2as (CAIDA): "<red>\t<longitud>\t<asn>" (admite .gz)
+ASN_PFX2AS = os.environ.get("ASN_PFX2AS", "/app/pfx2as.txt")
+# Formato nombres (RIPE asn.txt): "<asn> <descripción>, <país>" (opcional)
+ASN_NOMBRES = os.environ.get("ASN_NOMBRES", "/app/asn_nombres.txt")
+# Si una IP no está en la tabla, consultar whois en vivo
+ASN_WHOIS_FALLBACK = os.environ.get("ASN_WHOIS_FALLBACK", "1") == "1"
+
+
+def _abrir(ruta: str):
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rt", encoding="utf-8", errors="ignore")
+    return open(ruta, encoding="utf-8", errors="ignore")
+
+
+def _ip_a_entero(ip_str: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip_str), "big")
+
+
+def _entero_a_ip(valor: int) -> str:
+    return socket.inet_ntoa(int(valor).to_bytes(4, "big"))
+
+
+def cargar_nombres(ruta: str) -> dict:
+    """{asn: (descripción, país)} desde un fichero tipo asn.txt"""
+    nombres = {}
+    with _abrir(ruta) as f:
+        for linea in f:
+            asn, _, desc = linea.strip().partition(" ")
+            if not asn.isdigit() or not desc:
+                continue
+            cuerpo, _, pais = desc.rpartition(", ")
+            nombres[asn] = (desc, pais if cuerpo and len(pais) == 2 else None)
+    return nombres
+
+
+def aplanar_prefijos(prefijos: list) -> list:
+    """
+    Convierte prefijos anidados [(inicio, fin, id)] en segmentos disjuntos
+    [(inicio, fin, id)] donde cada segmento apunta al prefijo más específico.
+    Los prefijos deben venir ordenados por inicio y, a igual inicio, del más
+    amplio al más específico.
+    """
+    segmentos = []
+    pila = []
+    cursor = 0
+
+    def cerrar_hasta(limite):
+        nonlocal cursor
+        while pila and pila[-1][0] < limite:
+            fin, idx = pila.pop()
+            if cursor <= fin:
+                segmentos.append((cursor, fin, idx))
+                cursor = fin + 1
+
+    for inicio, fin, idx in prefijos:
+        cerrar_hasta(inicio)
+        if pila and cursor < inicio:
+            segmentos.append((cursor, inicio - 1, pila[-1][1]))
+        pila.append((fin, idx))
+        cursor = inicio
+    cerrar_hasta(1 << 33)
+    return segmentos
+
+
+class TablaASN:
+    """
+    Prefijos IPv4 -> ASN aplanados en segmentos disjuntos ordenados.
+
+    Cada segmento apunta al prefijo más específico que lo cubre, así que la
+    coincidencia del prefijo más largo es una única búsqueda binaria.
+    """
+
+    def __init__(self, inicios, fines, prefijo_idx, redes, longitudes, asn_idx, asns, nombres):
+        self._inicios = inicios
+        self._fines = fines
+        self._prefijo_idx = prefijo_idx
+        self._redes = redes
+        self._longitudes = longitudes
+        self._asn_idx = asn_idx
+        self._asns = asns
+        self._nombres = nombres
+
+    def __len__(self):
+        return len(self._redes)
+
+    @classmethod
+    def vacia(cls):
+        vacio = np.zeros(0, dtype=np.uint32)
+        return cls(vacio, vacio, vacio, vacio, np.zeros(0, dtype=np.uint8), vacio, [], {})
+
+    @classmethod
+    def desde_pfx2as(cls, ruta: str, ruta_nombres: str = None):
+        unicos = {}
+        with _abrir(ruta) as f:
+            for linea in f:
+                partes = linea.split()
+                if len(partes) < 3:
+                    continue
+                try:
+                    red = _ip_a_entero(partes[0])
+                    longitud = int(partes[1])
+                except (OSError, ValueError):
+                    continue
+                if not 0 <= longitud <= 32:
+                    continue
+                # Multi-origen ("13335_209") o AS-set ("13335,4444"): nos quedamos con el primero
+                asn = partes[2].replace(",", "_").split("_")[0]
+                mascara = (0xFFFFFFFF << (32 - longitud)) & 0xFFFFFFFF
+                unicos[(red & mascara, longitud)] = asn
+
+        claves = sorted(unicos)
+        asns_unicos = {}
+        redes = np.array([red for red, _ in claves], dtype=np.uint32)
+        longitudes = np.array([lon for _, lon in claves], dtype=np.uint8)
+        asn_idx = [asns_unicos.setdefault(unicos[c], len(asns_unicos)) for c in claves]
+
+        segmentos = aplanar_prefijos([
+            (red, red + (1 << (32 - lon)) - 1, i) for i, (red, lon) in enumerate(claves)
+        ])
+        arr = np.array(segmentos, dtype=np.uint32).reshape(-1, 3)
+
+        nombres = {}
+        if ruta_nombres and os.path.exists(ruta_nombres):
+            nombres = cargar_nombres(ruta_nombres)
+
+        return cls(
+            np.ascontiguousarray(arr[:, 0]),
+            np.ascontiguousarray(arr[:, 1]),
+            np.ascontiguousarray(arr[:, 2]),
+            redes,
+            longitudes,
+            np.array(asn_idx, dtype=np.uint32),
+            list(asns_unicos),
+            {a: nombres[a] for a in asns_unicos if a in nombres}
+        )
+
+    @classmethod
+    def cargar(cls, ruta: str = ASN_PFX2AS, ruta_nombres: str = ASN_NOMBRES):
+        if not os.path.exists(ruta):
+            return cls.vacia()
+        tabla = cls.desde_pfx2as(ruta, ruta_nombres)
+        logger.warning(f"Tabla ASN offline cargada: {len(tabla)} prefijos")
+        return tabla
+
+    def buscar(self, ip_str: str):
+        """Mismos campos que whois (asn, asn_cidr, asn_desc, asn_country_code) o None"""
+        if not len(self._inicios):
+            return None
+        try:
+            ip_int = _ip_a_entero(ip_str)
+        except OSError:
+            return None
+        pos = int(np.searchsorted(self._inicios, ip_int, side="right")) - 1
+        if pos < 0 or ip_int > self._fines[pos]:
+            return None
+        prefijo = int(self._prefijo_idx[pos])
+        asn = self._asns[self._asn_idx[prefijo]]
+        desc, pais = self._nombres.get(asn, (None, None))
+        return {
+            "asn": asn,
+            "asn_cidr": f"{_entero_a_ip(self._redes[prefijo])}/{self._longitudes[prefijo]}",
+            "asn_desc": desc,
+            "asn_country_code": pais
+        }
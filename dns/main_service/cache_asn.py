@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+import ipaddress
+import logging
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Cache ASN persistente por bloque CIDR (colección cache_asn)
+# -------------------------------------------------------------------
+CACHE_ASN_TTL_DIAS = int(os.environ.get("ASN_CACHE_TTL_DIAS", "30"))
+# Cada cuántos segundos se traen los bloques nuevos guardados por otros workers
+CACHE_ASN_REFRESCO = int(os.environ.get("ASN_CACHE_REFRESCO", "300"))
+
+CAMPOS_ASN = ("asn", "asn_cidr", "asn_desc", "asn_country_code")
+
+
+def _utc(fecha: datetime) -> datetime:
+    return fecha if fecha.tzinfo else fecha.replace(tzinfo=timezone.utc)
+
+
+class CacheASN:
+    """
+    Resultados whois indexados por el bloque CIDR que devuelven.
+
+    En memoria se guarda un diccionario por longitud de prefijo
+    ({longitud: {red: info}}), de modo que cualquier IP dentro de un bloque
+    conocido se resuelve por coincidencia del prefijo más largo sin whois.
+    La colección Mongo comparte los bloques entre workers y caduca con TTL.
+    """
+
+    def __init__(self, obtener_coleccion):
+        self._obtener_coleccion = obtener_coleccion
+        self._por_longitud = {}
+        self._longitudes = []
+        self._lock = threading.Lock()
+        self._ultima_carga = None
+        self._ultimo_refresco = 0.0
+
+    def _insertar(self, red: ipaddress.IPv4Network, info: dict, expira: float):
+        with self._lock:
+            tabla = self._por_longitud.setdefault(red.prefixlen, {})
+            tabla[int(red.network_address)] = (info, expira)
+            if red.prefixlen not in self._longitudes:
+                self._longitudes = sorted(self._por_longitud, reverse=True)
+
+    def _cargar_desde(self, desde):
+        filtro = {"expira": {"$gt": datetime.now(timezone.utc)}}
+        if desde is not None:
+            filtro["actualizado"] = {"$gt": desde}
+        ultima = desde
+        for doc in self._obtener_coleccion().find(filtro):
+            info = {k: doc.get(k) for k in CAMPOS_ASN}
+            self._insertar(ipaddress.ip_network(doc["_id"]), info, _utc(doc["expira"]).timestamp())
+            actualizado = _utc(doc["actualizado"])
+            if ultima is None or actualizado > ultima:
+                ultima = actualizado
+        self._ultima_carga = ultima
+        self._ultimo_refresco = time.time()
+
+    def cargar(self):
+        """Carga todos los bloques vigentes (al arrancar el proceso worker)"""
+        try:
+            self._cargar_desde(None)
+            logger.warning(f"Cache ASN cargada: {sum(len(t) for t in self._por_longitud.values())} bloques")
+        except Exception as e:
+            logger.error(f"No se pudo cargar la cache ASN: {e}")
+
+    def _refrescar_si_toca(self):
+        if time.time() - self._ultimo_refresco < CACHE_ASN_REFRESCO:
+            return
+        self._ultimo_refresco = time.time()
+        try:
+            self._cargar_desde(self._ultima_carga)
+        except Exception as e:
+            logger.error(f"No se pudo refrescar la cache ASN: {e}")
+
+    def buscar(self, ip_str: str):
+        """Info ASN del bloque más específico que contiene la IP o None"""
+        self._refrescar_si_toca()
+        try:
+            ip_int = int(ipaddress.IPv4Address(ip_str))
+        except ValueError:
+            return None
+        ahora = time.time()
+        for longitud in self._longitudes:
+            mascara = (0xFFFFFFFF << (32 - longitud)) & 0xFFFFFFFF
+            entrada = self._por_longitud[longitud].get(ip_int & mascara)
+            if entrada is not None and entrada[1] > ahora:
+                return entrada[0]
+        return None
+
+    def guardar(self, ip_str: str, info: dict):
+        """Guarda un resultado whois bajo cada bloque IPv4 de su asn_cidr que contenga la IP"""
+        ip = ipaddress.ip_address(ip_str)
+        ahora = datetime.now(timezone.utc)
+        expira = ahora + timedelta(days=CACHE_ASN_TTL_DIAS)
+        datos = {k: info.get(k) for k in CAMPOS_ASN}
+        for cidr in (info.get("asn_cidr") or "").split(","):
+            try:
+                red = ipaddress.ip_network(cidr.strip(), strict=False)
+            except ValueError:
+                continue
+            if red.version != 4 or ip not in red:
+                continue
+            self._insertar(red, datos, expira.timestamp())
+            try:
+                self._obtener_coleccion().update_one(
+                    {"_id": str(red)},
+                    {"$set": {**datos, "actualizado": ahora, "expira": expira}},
+                    upsert=True
+                )
+            except Exception as e:
+                logger.error(f"No se pudo guardar el bloque ASN {red}: {e}")
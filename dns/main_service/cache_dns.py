@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+import time
+
+from pymongo.write_concern import WriteConcern
+
+# -------------------------------------------------------------------
+# Cache de respuestas DNS con TTL: L1 en proceso + L2 compartida en Mongo
+# -------------------------------------------------------------------
+CACHE_DNS_ACTIVA = os.environ.get("DNS_CACHE", "1") == "1"
+CACHE_DNS_L1_MAX = int(os.environ.get("DNS_CACHE_L1_MAX", "50000"))
+CACHE_DNS_TTL_MIN = int(os.environ.get("DNS_CACHE_TTL_MIN", "60"))
+CACHE_DNS_TTL_MAX = int(os.environ.get("DNS_CACHE_TTL_MAX", "86400"))
+# TTL para respuestas negativas (NXDOMAIN / sin respuesta)
+CACHE_DNS_TTL_NEGATIVO = int(os.environ.get("DNS_CACHE_TTL_NEGATIVO", "300"))
+
+
+class CacheDNS:
+    """
+    Cache de respuestas DNS que respeta el TTL de los registros.
+
+    La L1 es un LRU por proceso; la L2 es la colección `cache_dns`, compartida
+    por todos los workers y contenedores. Los valores guardados son los ya
+    normalizados por el motor de resolución.
+    """
+
+    def __init__(self, obtener_coleccion, max_l1: int = CACHE_DNS_L1_MAX):
+        self._obtener_coleccion = obtener_coleccion
+        self._max_l1 = max_l1
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._contadores = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "errores_l2": 0}
+
+    @staticmethod
+    def _clave(nombre: str, tipo: str) -> str:
+        return f"{nombre.lower().rstrip('.')}|{tipo}"
+
+    def _contar(self, campo: str):
+        with self._lock:
+            self._contadores[campo] += 1
+
+    def _guardar_l1(self, clave: str, valores: list, expira: float):
+        with self._lock:
+            self._l1[clave] = (valores, expira)
+            self._l1.move_to_end(clave)
+            while len(self._l1) > self._max_l1:
+                self._l1.popitem(last=False)
+
+    def obtener_local(self, nombre: str, tipo: str):
+        """Valores en L1 o None si no están (o han caducado)"""
+        clave = self._clave(nombre, tipo)
+        with self._lock:
+            entrada = self._l1.get(clave)
+            if entrada is not None:
+                valores, expira = entrada
+                if expira > time.time():
+                    self._l1.move_to_end(clave)
+                    self._contadores["l1_hits"] += 1
+                    return valores
+                del self._l1[clave]
+        return None
+
+    def obtener_compartida(self, nombre: str, tipo: str):
+        """Valores en L2 (Mongo) o None; un acierto se copia a L1"""
+        clave = self._clave(nombre, tipo)
+        ahora = datetime.now(timezone.utc)
+        try:
+            doc = self._obtener_coleccion().find_one(
+                {"_id": clave, "expira": {"$gt": ahora}},
+                {"valores": 1, "expira": 1}
+            )
+        except Exception:
+            self._contar("errores_l2")
+            doc = None
+        if doc is None:
+            self._contar("misses")
+            return None
+        expira = doc["expira"]
+        if expira.tzinfo is None:
+            expira = expira.replace(tzinfo=timezone.utc)
+        self._guardar_l1(clave, doc["valores"], expira.timestamp())
+        self._contar("l2_hits")
+        return doc["valores"]
+
+    def guardar(self, nombre: str, tipo: str, valores: list, ttl: int = None):
+        """Guarda una respuesta; sin ttl se considera respuesta negativa"""
+        if ttl is None:
+            ttl = CACHE_DNS_TTL_NEGATIVO
+        else:
+            ttl = max(CACHE_DNS_TTL_MIN, min(CACHE_DNS_TTL_MAX, ttl))
+        clave = self._clave(nombre, tipo)
+        expira = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        self._guardar_l1(clave, valores, expira.timestamp())
+        try:
+            # Escritura sin confirmación: la cache no debe añadir latencia
+            self._obtener_coleccion().with_options(
+                write_concern=WriteConcern(w=0)
+            ).update_one(
+                {"_id": clave},
+                {"$set": {"valores": valores, "expira": expira}},
+                upsert=True
+            )
+        except Exception:
+            self._contar("errores_l2")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            stats = dict(self._contadores)
+            stats["l1_entradas"] = len(self._l1)
+        consultas = stats["l1_hits"] + stats["l2_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["l1_hits"] + stats["l2_hits"]) / consultas, 4) if consultas else 0.0
+        return stats
+
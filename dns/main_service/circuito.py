@@ -0,0 +1,225 @@
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Cortocircuito ante servicios externos (whois, OpenData...)
+# -------------------------------------------------------------------
+# Mismo fichero en dns/main_service y dns/collectors/opendata_service (cada
+# servicio se construye con su propio contexto): cualquier cambio va en los
+# dos; test_circuito.py y los despliegues comprueban que son idénticos.
+# Fallos seguidos que abren el circuito
+CIRCUITO_UMBRAL = int(os.environ.get("CIRCUITO_UMBRAL", "5"))
+# Duración de la primera apertura; cada sonda fallida la duplica hasta el tope
+CIRCUITO_APERTURA_SEGUNDOS = float(os.environ.get("CIRCUITO_APERTURA_SEGUNDOS", "30"))
+CIRCUITO_APERTURA_MAX_SEGUNDOS = float(os.environ.get("CIRCUITO_APERTURA_MAX_SEGUNDOS", "900"))
+# Con "1" las aperturas se comparten entre procesos a través de la colección circuitos
+CIRCUITO_COMPARTIDO = os.environ.get("CIRCUITO_COMPARTIDO", "1") == "1"
+# Cada cuánto se relee el estado compartido
+CIRCUITO_REFRESCO_SEGUNDOS = float(os.environ.get("CIRCUITO_REFRESCO_SEGUNDOS", "5"))
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    """El servicio está en pausa: la llamada no se ha hecho"""
+
+
+def _epoch(fecha) -> float:
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.timestamp()
+
+
+class Circuito:
+    """
+    Estado de un servicio externo para dejar de llamarlo mientras falla:
+      - cerrado: las llamadas pasan; `umbral` fallos seguidos lo abren
+      - abierto: permitir() devuelve False hasta que vence la apertura, así
+        que quien llama falla al momento o usa su respaldo
+      - semiabierto: vencida la apertura pasa una sola sonda; si va bien se
+        cierra y si falla se reabre con el doble de tiempo (hasta el tope)
+
+    Quien llama informa del resultado con exito()/fallo(), con abrir() si
+    el servicio pide esperar (p. ej. un 429) o con liberar() si al final no
+    ha llegado a llamarlo. Con una colección, aperturas y
+    cierres se publican en `circuitos` ({_id: nombre}) y todos los procesos
+    los respetan; la sonda la hace un solo proceso del cluster. Los fallos
+    seguidos se cuentan por proceso.
+    """
+
+    def __init__(self, nombre: str, obtener_coleccion=None, umbral: int = CIRCUITO_UMBRAL,
+                 apertura: float = CIRCUITO_APERTURA_SEGUNDOS, apertura_max: float = CIRCUITO_APERTURA_MAX_SEGUNDOS,
+                 refresco: float = CIRCUITO_REFRESCO_SEGUNDOS):
+        self.nombre = nombre
+        self._obtener_coleccion = obtener_coleccion
+        self._umbral = max(1, umbral)
+        self._apertura_base = apertura
+        self._apertura_max = apertura_max
+        self._refresco = refresco
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos = 0
+        self._apertura = apertura
+        self._abierto_hasta = 0.0
+        self._sonda_en_curso = False
+        self._ultimo_refresco = 0.0
+        self._contadores = {"exitos": 0, "fallos": 0, "rechazadas": 0, "aperturas": 0}
+
+    # -- estado compartido ----------------------------------------------
+    def _refrescar(self):
+        if self._obtener_coleccion is None or time.time() - self._ultimo_refresco < self._refresco:
+            return
+        self._ultimo_refresco = time.time()
+        try:
+            doc = self._obtener_coleccion().find_one({"_id": self.nombre})
+        except Exception as e:
+            logger.error(f"No se pudo leer el circuito {self.nombre}: {e}")
+            return
+        if not doc:
+            return
+        with self._lock:
+            if doc.get("estado") == ABIERTO and doc.get("abierto_hasta"):
+                hasta = _epoch(doc["abierto_hasta"])
+                if hasta > self._abierto_hasta:
+                    self._estado = ABIERTO
+                    self._abierto_hasta = hasta
+                    self._apertura = doc.get("apertura_segundos", self._apertura)
+            elif doc.get("estado") == CERRADO and self._estado == ABIERTO and not self._sonda_en_curso:
+                # Otro proceso lo ha cerrado con una sonda buena
+                self._cerrar_local()
+
+    def _publicar(self, cambios: dict, eliminar: dict = None, incrementar: dict = None):
+        if self._obtener_coleccion is None:
+            return
+        operacion = {"$set": {**cambios, "actualizado": datetime.now(timezone.utc)}}
+        if eliminar:
+            operacion["$unset"] = eliminar
+        if incrementar:
+            operacion["$inc"] = incrementar
+        try:
+            self._obtener_coleccion().update_one({"_id": self.nombre}, operacion, upsert=True)
+        except Exception as e:
+            logger.error(f"No se pudo publicar el circuito {self.nombre}: {e}")
+
+    def _reclamar_sonda(self) -> bool:
+        """En modo compartido solo un proceso sondea a la vez"""
+        if self._obtener_coleccion is None:
+            return True
+        ahora = datetime.now(timezone.utc)
+        try:
+            col = self._obtener_coleccion()
+            doc = col.find_one_and_update(
+                {"_id": self.nombre, "sonda_hasta": {"$not": {"$gt": ahora}}},
+                {"$set": {"estado": SEMIABIERTO, "sonda_hasta": ahora + timedelta(seconds=self._apertura)}}
+            )
+            return doc is not None or col.count_documents({"_id": self.nombre}, limit=1) == 0
+        except Exception as e:
+            logger.error(f"No se pudo reclamar la sonda del circuito {self.nombre}: {e}")
+            return True
+
+    # -- uso ------------------------------------------------------------
+    def _cerrar_local(self):
+        self._estado = CERRADO
+        self._fallos = 0
+        self._apertura = self._apertura_base
+        self._abierto_hasta = 0.0
+        self._sonda_en_curso = False
+
+    def disponible(self) -> bool:
+        """Si una llamada tendría opción de pasar (no consume la sonda)"""
+        self._refrescar()
+        with self._lock:
+            return self._estado == CERRADO or (time.time() >= self._abierto_hasta and not self._sonda_en_curso)
+
+    def segundos_para_sonda(self) -> float:
+        with self._lock:
+            return max(0.0, self._abierto_hasta - time.time())
+
+    def permitir(self) -> bool:
+        """True si la llamada puede hacerse; en semiabierto, la llamada es la sonda"""
+        self._refrescar()
+        with self._lock:
+            if self._estado == CERRADO:
+                return True
+            if time.time() < self._abierto_hasta or self._sonda_en_curso:
+                self._contadores["rechazadas"] += 1
+                return False
+            self._estado = SEMIABIERTO
+            self._sonda_en_curso = True
+        if self._reclamar_sonda():
+            return True
+        # Otro proceso está sondeando: esperar a ver qué publica
+        with self._lock:
+            self._estado = ABIERTO
+            self._sonda_en_curso = False
+            self._abierto_hasta = time.time() + self._refresco
+            self._contadores["rechazadas"] += 1
+        return False
+
+    def exito(self):
+        with self._lock:
+            self._contadores["exitos"] += 1
+            self._fallos = 0
+            if self._estado == CERRADO:
+                return
+            self._cerrar_local()
+        logger.warning(f"🔌 Circuito {self.nombre} cerrado")
+        self._publicar({"estado": CERRADO}, eliminar={"abierto_hasta": "", "sonda_hasta": ""})
+
+    def liberar(self):
+        """Devuelve la sonda sin veredicto (la llamada no llegó a probar el servicio)"""
+        with self._lock:
+            if not self._sonda_en_curso:
+                return
+            self._estado = ABIERTO
+            self._sonda_en_curso = False
+        self._publicar({"estado": ABIERTO}, eliminar={"sonda_hasta": ""})
+
+    def fallo(self, motivo: str = ""):
+        with self._lock:
+            self._contadores["fallos"] += 1
+            self._fallos += 1
+            if self._estado == SEMIABIERTO:
+                segundos = self._apertura * 2
+            elif self._estado == CERRADO and self._fallos >= self._umbral:
+                segundos = self._apertura
+            else:
+                return
+        self.abrir(segundos, motivo)
+
+    def abrir(self, segundos: float = None, motivo: str = ""):
+        """Abre el circuito ya, p. ej. cuando el servicio pide esperar (429, Retry-After)"""
+        segundos = min(self._apertura_max, segundos or self._apertura)
+        with self._lock:
+            self._estado = ABIERTO
+            self._fallos = 0
+            self._apertura = segundos
+            self._abierto_hasta = time.time() + segundos
+            self._sonda_en_curso = False
+            self._contadores["aperturas"] += 1
+        logger.warning(f"🔌 Circuito {self.nombre} abierto {segundos:.0f}s: {motivo}")
+        self._publicar(
+            {"estado": ABIERTO,
+             "abierto_hasta": datetime.now(timezone.utc) + timedelta(seconds=segundos),
+             "apertura_segundos": segundos,
+             "motivo": motivo[:500]},
+            eliminar={"sonda_hasta": ""},
+            incrementar={"aperturas": 1}
+        )
+
+    def estadisticas(self) -> dict:
+        """Estado y contadores de este proceso (para worker_stats)"""
+        with self._lock:
+            return {
+                "estado": self._estado,
+                "fallos_seguidos": self._fallos,
+                "segundos_para_sonda": round(max(0.0, self._abierto_hasta - time.time()), 1),
+                **self._contadores
+            }
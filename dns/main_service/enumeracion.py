@@ -0,0 +1,159 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Enumeración pasiva de subdominios en streaming (enumeradores vía pipe)
+# -------------------------------------------------------------------
+# Comando de cada enumerador; su salida debe ser un nombre por línea
+ENUMERADORES = {
+    "subfinder": lambda dominio: ["subfinder", "-d", dominio, "-silent"],
+    # Todas las fuentes de subfinder, incluidas las lentas (perfil profundo)
+    "subfinder_todas": lambda dominio: ["subfinder", "-d", dominio, "-silent", "-all"],
+    "assetfinder": lambda dominio: ["assetfinder", "--subs-only", dominio],
+}
+ENUMERADORES_ACTIVOS = [
+    n.strip() for n in os.environ.get("ENUMERADORES", "subfinder,assetfinder").split(",") if n.strip()
+]
+
+SUBFINDER_STREAMING = os.environ.get("SUBFINDER_STREAMING", "1") == "1"
+SUBFINDER_TIMEOUT = int(os.environ.get("SUBFINDER_TIMEOUT", "300"))
+# Dominios por ejecución de subfinder en modo lote (-dL); 1 = desactivado
+SUBFINDER_LOTE = int(os.environ.get("SUBFINDER_LOTE", "1"))
+SUBFINDER_LOTE_TIMEOUT = int(os.environ.get("SUBFINDER_LOTE_TIMEOUT", "900"))
+# Vigencia de la enumeración guardada por apex; 0 = sin cache
+ENUMERACION_CACHE_TTL_HORAS = float(os.environ.get("ENUMERACION_CACHE_TTL_HORAS", "168"))
+
+
+def normalizar_subdominio(linea: str) -> str:
+    return linea.strip().lower().rstrip(".")
+
+
+def pertenece(sub: str, dominio: str) -> bool:
+    return sub.endswith(f".{dominio}") or sub == dominio
+
+
+async def _ejecutar_enumerador(nombre: str, dominio: str, al_ver, timeout: float) -> list:
+    """Ejecuta un enumerador y pasa cada línea válida a al_ver(sub); devuelve errores"""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *ENUMERADORES[nombre](dominio),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except Exception as e:
+        return [f"{nombre} excepción: {e}"]
+
+    # stderr se drena en paralelo para que el pipe no bloquee al proceso
+    lector_stderr = asyncio.ensure_future(proc.stderr.read())
+    errores = []
+
+    async def leer_stdout():
+        async for linea in proc.stdout:
+            sub = normalizar_subdominio(linea.decode(errors="ignore"))
+            if sub and pertenece(sub, dominio):
+                al_ver(sub)
+        return await proc.wait()
+
+    try:
+        codigo = await asyncio.wait_for(leer_stdout(), timeout)
+        if codigo != 0:
+            stderr = (await lector_stderr).decode(errors="ignore")
+            errores.append(f"{nombre} error: {stderr or codigo}")
+    except asyncio.TimeoutError:
+        errores.append(f"{nombre} timeout tras {int(timeout)}s")
+    except Exception as e:
+        errores.append(f"{nombre} excepción: {e}")
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        if not lector_stderr.done():
+            lector_stderr.cancel()
+    return errores
+
+
+async def enumerar_streaming(dominio: str, al_encontrar, enumeradores: list = None,
+                             timeout: int = SUBFINDER_TIMEOUT):
+    """
+    Ejecuta a la vez los enumeradores pasivos bajo un mismo plazo y llama a
+    al_encontrar(sub, fuentes) con cada subdominio nuevo en cuanto cualquiera
+    lo emite (ya filtrado y sin duplicados). `fuentes` es una copia con los
+    enumeradores que lo han encontrado hasta ese momento; las definitivas son
+    las del resultado.
+    Devuelve ({sub: [enumeradores que lo encontraron]}, errores).
+    """
+    enumeradores = [n for n in (enumeradores or ENUMERADORES_ACTIVOS) if n in ENUMERADORES]
+    fuentes = {}
+
+    def al_ver(nombre):
+        def registrar(sub):
+            if sub not in fuentes:
+                fuentes[sub] = [nombre]
+                al_encontrar(sub, list(fuentes[sub]))
+            elif nombre not in fuentes[sub]:
+                fuentes[sub].append(nombre)
+        return registrar
+
+    resultados = await asyncio.gather(*(
+        _ejecutar_enumerador(n, dominio, al_ver(n), timeout) for n in enumeradores
+    ))
+    return fuentes, [e for errores in resultados for e in errores]
+
+
+# -------------------------------------------------------------------
+# Cache de enumeraciones por apex (colección cache_enumeracion)
+# -------------------------------------------------------------------
+class CacheEnumeracion:
+    """Última enumeración completa de cada apex, reutilizable mientras esté vigente"""
+
+    def __init__(self, obtener_coleccion, ttl_horas: float = ENUMERACION_CACHE_TTL_HORAS):
+        self._obtener_coleccion = obtener_coleccion
+        self._ttl = timedelta(hours=ttl_horas)
+
+    @property
+    def activa(self) -> bool:
+        return self._ttl > timedelta(0)
+
+    def obtener(self, dominio: str):
+        """Enumeración vigente con el formato del modo lote, o None"""
+        if not self.activa:
+            return None
+        try:
+            doc = self._obtener_coleccion().find_one(
+                {"_id": dominio, "expira": {"$gt": datetime.now(timezone.utc)}}
+            )
+        except Exception as e:
+            logger.error(f"No se pudo leer la enumeración cacheada de {dominio}: {e}")
+            return None
+        if doc is None:
+            return None
+        return {
+            "subdominios": [s["subdominio"] for s in doc["subdominios"]],
+            "fuentes": {s["subdominio"]: s.get("fuentes", []) for s in doc["subdominios"]},
+            "errores": [],
+            "fecha": doc["fecha"]
+        }
+
+    def guardar(self, dominio: str, subdominios: list, fuentes: dict = None):
+        if not self.activa:
+            return
+        fuentes = fuentes or {}
+        ahora = datetime.now(timezone.utc)
+        try:
+            self._obtener_coleccion().update_one(
+                {"_id": dominio},
+                {"$set": {
+                    "subdominios": [
+                        {"subdominio": s, "fuentes": fuentes.get(s, [])} for s in sorted(subdominios)
+                    ],
+                    "fecha": ahora,
+                    "expira": ahora + self._ttl
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"No se pudo guardar la enumeración de {dominio}: {e}")
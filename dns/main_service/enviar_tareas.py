@@ -5,7 +5,7 @@ from tasks import procesar_dominio
 def limpiar_identificacion(identificacion):
     return re.sub(r'[-\s]', '', identificacion)
 
-def enviar_tareas_desde_archivo(path):
+def enviar_tareas_desde_archivo(path, perfil=None):
     with open(path, "r", encoding="utf-8") as f:
         for linea in f:
             linea = linea.strip()
@@ -17,8 +17,9 @@ def enviar_tareas_desde_archivo(path):
             if len(partes) == 3:
                 dominio, titular, identificacion = partes
                 identificacion_limpia = limpiar_identificacion(identificacion)
-                procesar_dominio.delay(dominio, titular, identificacion_limpia)
+                procesar_dominio.delay(dominio, titular, identificacion_limpia, perfil=perfil)
 
 if __name__ == "__main__":
     archivo = sys.argv[1] if len(sys.argv) > 1 else "RISP_OTROS.csv"
-    enviar_tareas_desde_archivo(archivo)
+    perfil = sys.argv[2] if len(sys.argv) > 2 else None
+    enviar_tareas_desde_archivo(archivo, perfil)
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from historico import forma_canonica
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Buffer de escritura en bloque (dominios_historico + dominios_actuales)
+# -------------------------------------------------------------------
+# Documentos acumulados antes de escribir; 1 = escritura inmediata
+ESCRITURA_BUFFER_MAX = int(os.environ.get("ESCRITURA_BUFFER_MAX", "50"))
+# Segundos máximos que un documento espera en el buffer
+ESCRITURA_BUFFER_SEGUNDOS = float(os.environ.get("ESCRITURA_BUFFER_SEGUNDOS", "5"))
+# Subdominios por bulk_write en dominios_subdominios
+SUBDOMINIOS_LOTE = int(os.environ.get("SUBDOMINIOS_LOTE", "100"))
+
+
+class BufferEscritura:
+    """
+    Acumula los resultados de un proceso y los escribe en bloque: un
+    insert_many desordenado al histórico y un bulk_write de upserts a la
+    colección actual. Cada resultado puede llevar su propia entrada de
+    histórico (p. ej. un delta); si no, se inserta el documento tal cual.
+    Se vacía al llegar a `max_docs`, cuando el documento más antiguo supera
+    `max_segundos` o explícitamente con vaciar().
+
+    Los errores por documento se registran y se pasan a `al_error`; ante un
+    fallo de conexión los documentos vuelven al buffer para el siguiente intento.
+    Los campos de `eliminar` se borran de la colección actual en cada upsert.
+    Lo que deba ocurrir solo con el resultado ya guardado (p. ej. cerrar el
+    dominio en dominios_pendientes) se encarga con despues_de_escribir().
+    """
+
+    def __init__(self, obtener_historico, obtener_actual, max_docs: int = ESCRITURA_BUFFER_MAX,
+                 max_segundos: float = ESCRITURA_BUFFER_SEGUNDOS, al_error=None, eliminar=()):
+        self._obtener_historico = obtener_historico
+        self._obtener_actual = obtener_actual
+        self._eliminar = {campo: "" for campo in eliminar}
+        self._max_docs = max(1, max_docs)
+        self._max_segundos = max_segundos
+        self._al_error = al_error
+        self._docs = []
+        self._cierres = {}
+        self._fallidos = set()
+        self._primero = None
+        self._lock = threading.Lock()
+        self._vaciado = threading.Lock()
+        self._hilo = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _arrancar_temporizador(self):
+        # Los hilos no sobreviven al fork: se arranca en el proceso que escribe
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._vigilar, daemon=True)
+            self._hilo.start()
+
+    def _vigilar(self):
+        while True:
+            time.sleep(min(1.0, self._max_segundos))
+            if self._docs and time.time() - self._primero >= self._max_segundos:
+                self.vaciar()
+
+    def ultimo(self, dominio: str):
+        """Último resultado de `dominio` aún sin escribir, o None"""
+        with self._lock:
+            for info, _ in reversed(self._docs):
+                if info["dominio"] == dominio:
+                    return info
+        return None
+
+    def despues_de_escribir(self, dominio: str, accion) -> bool:
+        """
+        Ejecuta `accion()` cuando el último resultado de `dominio` esté escrito:
+        en el vaciado que lo escriba, si sigue en el buffer, o ahora mismo si
+        ya se escribió. Si su escritura falló, la acción se descarta (el
+        dominio queda reclamado y el recolector de leases lo reintenta).
+        Devuelve False si se descartó.
+        """
+        with self._vaciado:
+            with self._lock:
+                if any(info["dominio"] == dominio for info, _ in self._docs):
+                    self._cierres.setdefault(dominio, []).append(accion)
+                    return True
+                fallido = dominio in self._fallidos
+                self._fallidos.discard(dominio)
+        if fallido:
+            logger.warning(f"⚠️ {dominio} no se cierra: su resultado no se pudo escribir")
+            return False
+        accion()
+        return True
+
+    def _ejecutar_cierres(self, cierres: dict, errores: list):
+        fallidos = {err["dominio"] for err in errores}
+        with self._lock:
+            self._fallidos |= fallidos - set(cierres)
+        for dominio, acciones in cierres.items():
+            if dominio in fallidos:
+                logger.warning(f"⚠️ {dominio} no se cierra: su resultado no se pudo escribir")
+                continue
+            for accion in acciones:
+                try:
+                    accion()
+                except Exception as e:
+                    logger.error(f"❌ Error cerrando {dominio} tras escribirlo: {e}")
+
+    def agregar(self, info: dict, historico: dict = None) -> list:
+        """Añade un resultado; devuelve los errores si esta llamada provocó el vaciado"""
+        with self._lock:
+            self._fallidos.discard(info["dominio"])
+            if not self._docs:
+                self._primero = time.time()
+            self._docs.append((info, historico if historico is not None else info))
+            lleno = len(self._docs) >= self._max_docs
+        if lleno:
+            return self.vaciar()
+        self._arrancar_temporizador()
+        return []
+
+    def _reportar(self, errores: list):
+        for err in errores:
+            logger.error(f"❌ Error escribiendo {err['dominio']} en {err['coleccion']}: {err['error']}")
+            if self._al_error:
+                self._al_error(err)
+
+    def vaciar(self) -> list:
+        """Escribe todo lo acumulado. Devuelve [{dominio, coleccion, error}] por documento fallido"""
+        with self._vaciado:
+            with self._lock:
+                docs, self._docs = self._docs, []
+                self._primero = None
+                cierres = {info["dominio"]: self._cierres.pop(info["dominio"])
+                           for info, _ in docs if info["dominio"] in self._cierres}
+            if not docs:
+                return []
+
+            errores = []
+            try:
+                errores += self._escribir_historico(docs)
+                errores += self._escribir_actual(docs)
+            except Exception as e:
+                # Fallo general (p. ej. conexión): se reintenta en el siguiente vaciado
+                logger.error(f"❌ Error escribiendo lote de {len(docs)} documentos: {e}")
+                with self._lock:
+                    self._docs = docs + self._docs
+                    self._primero = self._primero or time.time()
+                    for dominio, acciones in cierres.items():
+                        self._cierres[dominio] = acciones + self._cierres.get(dominio, [])
+                return [{"dominio": info["dominio"], "coleccion": None, "error": str(e)} for info, _ in docs]
+
+            self._reportar(errores)
+            self._ejecutar_cierres(cierres, errores)
+            return errores
+
+    def _escribir_historico(self, docs: list) -> list:
+        docs = [historico for _, historico in docs]
+        try:
+            self._obtener_historico().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # 11000 = ya insertado en un intento anterior (mismo _id): no es un fallo
+            return [
+                {"dominio": docs[err["index"]]["dominio"], "coleccion": "dominios_historico",
+                 "error": err.get("errmsg")}
+                for err in e.details.get("writeErrors", []) if err.get("code") != 11000
+            ]
+        return []
+
+    def _escribir_actual(self, docs: list) -> list:
+        # Un solo upsert por dominio (el más reciente) para no chocar con el índice único
+        ultimos = {}
+        for info, _ in docs:
+            ultimos[info["dominio"]] = info
+        dominios = list(ultimos)
+        operaciones = []
+        for dominio in dominios:
+            cambios = {"$set": {k: v for k, v in ultimos[dominio].items() if k != "_id"}}
+            eliminar = {k: v for k, v in self._eliminar.items() if k not in cambios["$set"]}
+            if eliminar:
+                cambios["$unset"] = eliminar
+            operaciones.append(UpdateOne({"dominio": dominio}, cambios, upsert=True))
+        try:
+            self._obtener_actual().bulk_write(operaciones, ordered=False)
+        except BulkWriteError as e:
+            return [
+                {"dominio": dominios[err["index"]], "coleccion": "dominios_actuales",
+                 "error": err.get("errmsg")}
+                for err in e.details.get("writeErrors", [])
+            ]
+        return []
+
+
+class EscritorSubdominios:
+    """
+    Escribe los subdominios de un apex en dominios_subdominios a medida que se
+    resuelven, en lotes de upserts por (apex, subdominio), sin acumular los
+    resultados en memoria. Lleva los contadores y un hash del conjunto
+    (independiente del orden) para el resumen que se guarda en el apex.
+    """
+
+    def __init__(self, obtener_coleccion, apex: str, fecha_consulta, lote: int = SUBDOMINIOS_LOTE):
+        self._obtener_coleccion = obtener_coleccion
+        self._apex = apex
+        self._fecha = fecha_consulta
+        self._lote = max(1, lote)
+        self._ops = []
+        self._lock = threading.Lock()
+        self._hash = 0
+        self.total = 0
+        self.coincidencias_wildcard = 0
+        self.errores = 0
+
+    def agregar(self, doc: dict) -> bool:
+        """Añade un subdominio ({subdominio, dns, ...}); True si el lote está lleno"""
+        # Solo el contenido DNS: las fuentes dependen de qué enumeradores han corrido y
+        # de si la enumeración venía de la cache
+        contenido = {k: v for k, v in doc.items() if k != "fuentes"}
+        canonico = json.dumps(forma_canonica(contenido), sort_keys=True, separators=(",", ":"), default=str)
+        huella = int(hashlib.sha256(canonico.encode("utf-8")).hexdigest(), 16)
+        operacion = UpdateOne(
+            {"apex": self._apex, "subdominio": doc["subdominio"]},
+            {"$set": {**doc, "apex": self._apex, "fecha_consulta": self._fecha}},
+            upsert=True
+        )
+        with self._lock:
+            self._hash = (self._hash + huella) % (1 << 256)
+            self.total += 1
+            self._ops.append(operacion)
+            return len(self._ops) >= self._lote
+
+    def contar_wildcard(self):
+        with self._lock:
+            self.coincidencias_wildcard += 1
+
+    def vaciar(self):
+        with self._lock:
+            operaciones, self._ops = self._ops, []
+        if not operaciones:
+            return
+        try:
+            self._obtener_coleccion().bulk_write(operaciones, ordered=False)
+        except BulkWriteError as e:
+            fallos = e.details.get("writeErrors", [])
+            self.errores += len(fallos)
+            for err in fallos:
+                logger.error(f"❌ Error escribiendo subdominio de {self._apex}: {err.get('errmsg')}")
+        except Exception as e:
+            self.errores += len(operaciones)
+            logger.error(f"❌ Error escribiendo {len(operaciones)} subdominios de {self._apex}: {e}")
+
+    def fijar_fuentes(self, fuentes: dict):
+        """
+        Escribe lo pendiente y después las fuentes definitivas de los
+        subdominios ya guardados ({sub: [enumeradores]}); los nombres que no
+        llegaron a escribirse se ignoran.
+        """
+        self.vaciar()
+        operaciones = [
+            UpdateOne({"apex": self._apex, "subdominio": sub, "fecha_consulta": self._fecha},
+                      {"$set": {"fuentes": sorted(lista)}})
+            for sub, lista in fuentes.items()
+        ]
+        for i in range(0, len(operaciones), self._lote):
+            try:
+                self._obtener_coleccion().bulk_write(operaciones[i:i + self._lote], ordered=False)
+            except Exception as e:
+                logger.error(f"❌ Error guardando las fuentes de los subdominios de {self._apex}: {e}")
+
+    def resumen(self) -> dict:
+        with self._lock:
+            return {
+                "total": self.total,
+                "wildcard_coincidencias": self.coincidencias_wildcard,
+                "hash": f"{self._hash:064x}",
+            }
+
+    def finalizar(self, completo: bool = True) -> dict:
+        """
+        Escribe lo pendiente y devuelve el resumen para el apex. Si la
+        enumeración fue completa, borra los subdominios de escaneos anteriores
+        que ya no aparecen.
+        """
+        self.vaciar()
+        if completo and not self.errores:
+            try:
+                self._obtener_coleccion().delete_many(
+                    {"apex": self._apex, "fecha_consulta": {"$lt": self._fecha}}
+                )
+            except Exception as e:
+                logger.error(f"❌ Error limpiando subdominios antiguos de {self._apex}: {e}")
+        return self.resumen()
+
+
+def combinar_hashes(hashes: list) -> str:
+    """Hash del conjunto a partir de los de sus partes (mismo que con un solo escritor)"""
+    return f"{sum(int(h, 16) for h in hashes) % (1 << 256):064x}"
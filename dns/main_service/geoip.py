@@ -0,0 +1,141 @@
+import os
+import sys
+import csv
+import json
+import socket
+import ipaddress
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Índice GeoIP compacto (arrays ordenados + búsqueda binaria)
+# -------------------------------------------------------------------
+GEOIP_CSV = os.environ.get("GEOIP_CSV", "/app/ip_rangos.csv")
+# Versión precompilada: <base>.npy (rangos) + <base>.codigos.json (tablas de códigos)
+GEOIP_BIN = os.environ.get("GEOIP_BIN", "/app/ip_rangos.npy")
+
+_INICIO, _FIN, _PAIS, _CONTINENTE = range(4)
+
+
+def _ruta_codigos(ruta_bin: str) -> str:
+    return os.path.splitext(ruta_bin)[0] + ".codigos.json"
+
+
+def _ip_a_entero(ip_str: str) -> int:
+    return int.from_bytes(socket.inet_aton(ip_str), "big")
+
+
+class IndiceGeoIP:
+    """
+    Rangos IPv4 -> (país, continente) en un array uint32 de forma (4, n).
+
+    Las filas son inicio, fin, índice de país e índice de continente, ordenadas
+    por inicio. Al ser un único bloque numpy (cargado antes del fork o mapeado
+    desde disco) todos los procesos prefork comparten las mismas páginas.
+    """
+
+    def __init__(self, rangos: np.ndarray, paises: list, continentes: list):
+        self._rangos = rangos
+        self._paises = paises
+        self._continentes = continentes
+
+    def __len__(self):
+        return self._rangos.shape[1]
+
+    @classmethod
+    def vacio(cls):
+        return cls(np.zeros((4, 0), dtype=np.uint32), [], [])
+
+    @classmethod
+    def desde_csv(cls, ruta: str):
+        """Construye el índice desde el CSV start_ip,end_ip,country,continent (solo IPv4)"""
+        paises, continentes = {}, {}
+        filas = []
+        with open(ruta, encoding="utf-8") as f:
+            for r in csv.DictReader(f):
+                inicio = ipaddress.ip_address(r["start_ip"])
+                fin = ipaddress.ip_address(r["end_ip"])
+                if inicio.version != 4 or fin.version != 4:
+                    continue
+                filas.append((
+                    int(inicio),
+                    int(fin),
+                    paises.setdefault(r["country"], len(paises)),
+                    continentes.setdefault(r["continent"], len(continentes))
+                ))
+        rangos = np.array(filas, dtype=np.uint32).reshape(-1, 4)
+        rangos = rangos[np.argsort(rangos[:, _INICIO], kind="stable")]
+        return cls(np.ascontiguousarray(rangos.T), list(paises), list(continentes))
+
+    @classmethod
+    def desde_binario(cls, ruta: str):
+        """Mapea en memoria un índice precompilado con guardar()"""
+        rangos = np.load(ruta, mmap_mode="r")
+        with open(_ruta_codigos(ruta), encoding="utf-8") as f:
+            codigos = json.load(f)
+        return cls(rangos, codigos["paises"], codigos["continentes"])
+
+    @classmethod
+    def cargar(cls, ruta_bin: str = GEOIP_BIN, ruta_csv: str = GEOIP_CSV):
+        """Usa el binario si está al día respecto al CSV; si no, compila desde el CSV"""
+        hay_csv = os.path.exists(ruta_csv)
+        if os.path.exists(ruta_bin) and os.path.exists(_ruta_codigos(ruta_bin)):
+            if not hay_csv or os.path.getmtime(ruta_bin) >= os.path.getmtime(ruta_csv):
+                return cls.desde_binario(ruta_bin)
+        if not hay_csv:
+            return cls.vacio()
+        indice = cls.desde_csv(ruta_csv)
+        try:
+            indice.guardar(ruta_bin)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el índice GeoIP en {ruta_bin}: {e}")
+        return indice
+
+    def guardar(self, ruta_bin: str):
+        np.save(ruta_bin, np.ascontiguousarray(self._rangos))
+        with open(_ruta_codigos(ruta_bin), "w", encoding="utf-8") as f:
+            json.dump({"paises": self._paises, "continentes": self._continentes}, f)
+
+    def _resultado(self, pos: int) -> dict:
+        return {
+            "country": self._paises[self._rangos[_PAIS, pos]],
+            "continent": self._continentes[self._rangos[_CONTINENTE, pos]]
+        }
+
+    def buscar(self, ip_str: str) -> dict:
+        """{country, continent} de una IP o {} si no está en ningún rango"""
+        try:
+            ip_int = _ip_a_entero(ip_str)
+        except OSError:
+            return {}
+        pos = int(np.searchsorted(self._rangos[_INICIO], ip_int, side="right")) - 1
+        if pos < 0 or ip_int > self._rangos[_FIN, pos]:
+            return {}
+        return self._resultado(pos)
+
+    def buscar_lote(self, ips: list) -> list:
+        """Versión vectorizada de buscar() para muchas IPs a la vez"""
+        enteros = np.zeros(len(ips), dtype=np.uint32)
+        validas = np.zeros(len(ips), dtype=bool)
+        for i, ip in enumerate(ips):
+            try:
+                enteros[i] = _ip_a_entero(ip)
+                validas[i] = True
+            except OSError:
+                pass
+        pos = np.searchsorted(self._rangos[_INICIO], enteros, side="right") - 1
+        dentro = validas & (pos >= 0)
+        dentro[dentro] &= enteros[dentro] <= self._rangos[_FIN, pos[dentro]]
+        return [self._resultado(p) if ok else {} for p, ok in zip(pos.tolist(), dentro.tolist())]
+
+
+if __name__ == "__main__":
+    # Precompilar: python geoip.py [ip_rangos.csv] [ip_rangos.npy]
+    origen = sys.argv[1] if len(sys.argv) > 1 else GEOIP_CSV
+    destino = sys.argv[2] if len(sys.argv) > 2 else GEOIP_BIN
+    indice = IndiceGeoIP.desde_csv(origen)
+    indice.guardar(destino)
+    print(f"Índice GeoIP guardado en {destino}: {len(indice)} rangos")
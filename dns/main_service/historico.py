@@ -0,0 +1,165 @@
+import os
+import json
+import copy
+import hashlib
+
+import pymongo
+
+# -------------------------------------------------------------------
+# Histórico deduplicado por hash de contenido y almacenado como deltas
+# -------------------------------------------------------------------
+# Cada cuántos deltas se guarda de nuevo una instantánea completa
+HISTORICO_COMPLETO_CADA = int(os.environ.get("HISTORICO_COMPLETO_CADA", "20"))
+
+# Campos que no forman parte del contenido (cambian en cada escaneo o son internos)
+CAMPOS_EXCLUIDOS = {"_id", "fecha_consulta", "hash_contenido", "deltas_desde_completo"}
+
+TIPO_COMPLETO = "completo"
+TIPO_DELTA = "delta"
+TIPO_SIN_CAMBIOS = "sin_cambios"
+
+
+def contenido(info: dict) -> dict:
+    return {k: v for k, v in info.items() if k not in CAMPOS_EXCLUIDOS}
+
+
+def forma_canonica(valor):
+    """
+    Copia con las listas ordenadas: el orden en que llegan las respuestas DNS
+    rota entre consultas y no es contenido.
+    """
+    if isinstance(valor, dict):
+        return {k: forma_canonica(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple, set)):
+        return sorted(
+            (forma_canonica(v) for v in valor),
+            key=lambda v: json.dumps(v, sort_keys=True, default=str)
+        )
+    return valor
+
+
+def hash_contenido(info: dict) -> str:
+    """sha256 de la forma canónica del documento (sin fecha_consulta)"""
+    canonico = json.dumps(forma_canonica(contenido(info)), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonico.encode("utf-8")).hexdigest()
+
+
+def resumen(info: dict) -> dict:
+    """Métricas que usan los informes, presentes en todas las entradas del histórico"""
+    subdominios = (info.get("subdominios_resumen") or {}).get("total")
+    if subdominios is None:
+        subdominios = len(info.get("subdominios") or [])
+    return {
+        "registros_dns": len(info.get("dns") or {}),
+        "subdominios": subdominios,
+        "tiene_ssl": bool(info.get("ssl")),
+    }
+
+
+def calcular_diff(anterior: dict, nuevo: dict, ruta: list = None) -> dict:
+    """
+    Diferencia entre dos documentos: {"set": [[ruta, valor]], "unset": [ruta]}.
+    Las rutas son listas de claves; las listas y escalares se sustituyen enteros.
+    """
+    ruta = ruta or []
+    diff = {"set": [], "unset": []}
+    for clave in anterior:
+        if clave not in nuevo:
+            diff["unset"].append(ruta + [clave])
+    for clave, valor in nuevo.items():
+        previo = anterior.get(clave)
+        if clave in anterior and isinstance(previo, dict) and isinstance(valor, dict):
+            sub = calcular_diff(previo, valor, ruta + [clave])
+            diff["set"] += sub["set"]
+            diff["unset"] += sub["unset"]
+        elif clave not in anterior or previo != valor:
+            diff["set"].append([ruta + [clave], valor])
+    return diff
+
+
+def aplicar_diff(doc: dict, diff: dict) -> dict:
+    resultado = copy.deepcopy(doc)
+    for ruta in diff.get("unset", []):
+        destino = resultado
+        for clave in ruta[:-1]:
+            destino = destino.get(clave, {})
+        destino.pop(ruta[-1], None)
+    for ruta, valor in diff.get("set", []):
+        destino = resultado
+        for clave in ruta[:-1]:
+            destino = destino.setdefault(clave, {})
+        destino[ruta[-1]] = valor
+    return resultado
+
+
+def preparar_entrada(info: dict, anterior: dict = None, campos_eliminables=()) -> dict:
+    """
+    Entrada de dominios_historico para un resultado nuevo, comparándolo con el
+    último estado guardado (documento de dominios_actuales):
+      - sin_cambios: solo la marca de tiempo y el hash
+      - delta: diferencia respecto al estado anterior
+      - completo: instantánea entera (primera vez o cada HISTORICO_COMPLETO_CADA deltas)
+    Anota en `info` el hash y el contador de deltas que debe guardar la colección actual.
+
+    El delta solo compara los campos de main (los de `info` y los
+    `campos_eliminables` que main borra si no los trae): dominios_actuales
+    lleva también campos de otros procesos (p. ej. "empresa") que no están
+    en las instantáneas del histórico.
+    """
+    nuevo_hash = hash_contenido(info)
+    base = {
+        "dominio": info["dominio"],
+        "fecha_consulta": info["fecha_consulta"],
+        "hash": nuevo_hash,
+        "resumen": resumen(info),
+    }
+    hash_anterior = (anterior or {}).get("hash_contenido")
+    deltas = (anterior or {}).get("deltas_desde_completo", 0)
+
+    if hash_anterior == nuevo_hash:
+        info["hash_contenido"] = nuevo_hash
+        info["deltas_desde_completo"] = deltas
+        return {**base, "tipo": TIPO_SIN_CAMBIOS}
+
+    if hash_anterior is None or deltas + 1 >= HISTORICO_COMPLETO_CADA:
+        info["hash_contenido"] = nuevo_hash
+        info["deltas_desde_completo"] = 0
+        return {**base, "tipo": TIPO_COMPLETO, "documento": contenido(info)}
+
+    info["hash_contenido"] = nuevo_hash
+    info["deltas_desde_completo"] = deltas + 1
+    return {
+        **base,
+        "tipo": TIPO_DELTA,
+        "hash_anterior": hash_anterior,
+        "diff": calcular_diff(
+            {k: v for k, v in contenido(anterior).items() if k in info or k in campos_eliminables},
+            contenido(info)
+        ),
+    }
+
+
+def reconstruir_version(col_historico, dominio: str, fecha=None):
+    """
+    Documento completo de `dominio` tal como estaba en `fecha` (o el último),
+    partiendo de la instantánea completa más reciente y aplicando los deltas.
+    """
+    filtro = {"dominio": dominio}
+    if fecha is not None:
+        filtro["fecha_consulta"] = {"$lte": fecha}
+    entradas = []
+    for entrada in col_historico.find(filtro).sort("fecha_consulta", pymongo.DESCENDING):
+        entradas.append(entrada)
+        if entrada.get("tipo") == TIPO_COMPLETO or "tipo" not in entrada:
+            break
+    if not entradas:
+        return None
+
+    base = entradas.pop()
+    # Entradas anteriores a este formato guardan el documento entero en la raíz
+    doc = base["documento"] if "tipo" in base else contenido(base)
+    for entrada in reversed(entradas):
+        if entrada["tipo"] == TIPO_DELTA:
+            doc = aplicar_diff(doc, entrada["diff"])
+    ultima = entradas[0] if entradas else base
+    return {**doc, "fecha_consulta": ultima["fecha_consulta"]}
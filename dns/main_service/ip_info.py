@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Enriquecimiento de IPs normalizado (colección ip_info)
+# -------------------------------------------------------------------
+# Cada cuánto se recalcula la info ASN/geo de una IP
+IP_INFO_REFRESCO_HORAS = float(os.environ.get("IP_INFO_REFRESCO_HORAS", "24"))
+# Vigencia de una info sin ASN (error_asn: whois caído o en pausa...) antes de reintentarla
+IP_INFO_REFRESCO_ERROR_MINUTOS = float(os.environ.get("IP_INFO_REFRESCO_ERROR_MINUTOS", "30"))
+# IPs recordadas por proceso como ya registradas
+IP_INFO_L1_MAX = int(os.environ.get("IP_INFO_L1_MAX", "100000"))
+
+# Origen de la info ASN de cada documento
+FUENTE_WHOIS = "whois"      # tabla offline con respaldo whois
+FUENTE_OFFLINE = "offline"  # solo tabla offline y GeoIP (perfiles sin whois)
+
+
+class RegistroIPInfo:
+    """
+    Info ASN y geo de cada IP guardada una sola vez en `ip_info` ({_id: ip}).
+
+    Los registros DNS de los dominios solo llevan la IP; quien necesite la
+    info la cruza con esta colección. Una IP se recalcula y se escribe como
+    mucho una vez por ventana de refresco: antes de calcularla se comprueba
+    si otro worker ya la ha registrado, y el proceso recuerda las IPs vigentes
+    en un LRU para no volver a preguntar a Mongo.
+
+    Cada documento lleva la `fuente` que lo calculó y solo cuenta como
+    vigente para quien acepta esa fuente: un barrido offline no evita que un
+    escaneo con whois complete después la info ASN. Un resultado con
+    error_asn solo vale IP_INFO_REFRESCO_ERROR_MINUTOS y conserva la info ASN
+    anterior, si la había; el siguiente resultado bueno borra el error.
+    """
+
+    def __init__(self, obtener_coleccion, calcular, fuente: str = FUENTE_WHOIS, fuentes_validas: tuple = None,
+                 refresco_horas: float = IP_INFO_REFRESCO_HORAS,
+                 refresco_error_minutos: float = IP_INFO_REFRESCO_ERROR_MINUTOS, max_l1: int = IP_INFO_L1_MAX):
+        self._obtener_coleccion = obtener_coleccion
+        self._calcular = calcular
+        self._fuente = fuente
+        self._fuentes_validas = list(fuentes_validas or (fuente,))
+        self._refresco = timedelta(hours=refresco_horas)
+        self._refresco_error = timedelta(minutes=refresco_error_minutos)
+        self._max_l1 = max_l1
+        self._vigentes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vigente_local(self, ip: str) -> bool:
+        with self._lock:
+            expira = self._vigentes.get(ip)
+            if expira is not None and expira > time.time():
+                self._vigentes.move_to_end(ip)
+                return True
+        return False
+
+    def _recordar(self, ip: str, expira: float):
+        with self._lock:
+            self._vigentes[ip] = expira
+            self._vigentes.move_to_end(ip)
+            while len(self._vigentes) > self._max_l1:
+                self._vigentes.popitem(last=False)
+
+    def registrar(self, ip: str):
+        """Asegura que `ip` tiene info vigente en ip_info, calculándola si hace falta"""
+        if self._vigente_local(ip):
+            return
+        ahora = datetime.now(timezone.utc)
+        col = self._obtener_coleccion()
+        try:
+            doc = col.find_one(
+                {"_id": ip, "vigente_hasta": {"$gt": ahora}, "fuente": {"$in": self._fuentes_validas}},
+                {"vigente_hasta": 1}
+            )
+        except Exception as e:
+            logger.error(f"No se pudo consultar ip_info para {ip}: {e}")
+            doc = None
+        if doc is not None:
+            vigente_hasta = doc["vigente_hasta"]
+            if vigente_hasta.tzinfo is None:
+                vigente_hasta = vigente_hasta.replace(tzinfo=timezone.utc)
+            self._recordar(ip, vigente_hasta.timestamp())
+            return
+
+        info = self._calcular(ip)
+        error = "error_asn" in info
+        vigente_hasta = ahora + (self._refresco_error if error else self._refresco)
+        operacion = {"$set": {**info, "fuente": self._fuente, "actualizado": ahora, "vigente_hasta": vigente_hasta}}
+        if not error:
+            operacion["$unset"] = {"error_asn": ""}
+        try:
+            col.update_one({"_id": ip}, operacion, upsert=True)
+        except Exception as e:
+            logger.error(f"No se pudo guardar ip_info para {ip}: {e}")
+            return
+        self._recordar(ip, vigente_hasta.timestamp())
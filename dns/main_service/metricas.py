@@ -0,0 +1,111 @@
+import os
+import time
+import socket
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Métricas por proceso acumuladas en memoria (colección worker_stats)
+# -------------------------------------------------------------------
+# Cada cuántos segundos se escribe el upsert combinado
+METRICAS_FLUSH_SEGUNDOS = float(os.environ.get("METRICAS_FLUSH_SEGUNDOS", "5"))
+# Límites superiores (ms) de los cubos de los histogramas de latencia
+LIMITES_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000, 300000, 600000)
+
+
+def _cubo(ms: float) -> str:
+    for limite in LIMITES_MS:
+        if ms <= limite:
+            return f"le_{limite}"
+    return "inf"
+
+
+class AgregadorMetricas:
+    """
+    Acumula contadores, valores y latencias por etapa del proceso y los
+    escribe en worker_stats con un único upsert cada `flush_segundos` (y al
+    llamar a vaciar(), p. ej. al apagar el proceso).
+
+    Las latencias se guardan como histograma acumulado por etapa:
+    latencias.<etapa>.{n, suma_ms, cubos.le_<ms>}.
+    """
+
+    def __init__(self, obtener_coleccion, flush_segundos: float = METRICAS_FLUSH_SEGUNDOS):
+        self._obtener_coleccion = obtener_coleccion
+        self._flush_segundos = flush_segundos
+        self._inc = {}
+        self._set = {}
+        self._lock = threading.Lock()
+        self._vaciado = threading.Lock()
+        self._hilo = None
+
+    @staticmethod
+    def worker_id() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _arrancar_temporizador(self):
+        # Los hilos no sobreviven al fork: se arranca en el proceso que mide
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._vigilar, daemon=True)
+            self._hilo.start()
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self._flush_segundos)
+            self.vaciar()
+
+    def incrementar(self, campo: str, cantidad=1):
+        with self._lock:
+            self._inc[campo] = self._inc.get(campo, 0) + cantidad
+        self._arrancar_temporizador()
+
+    def establecer(self, campo: str, valor):
+        with self._lock:
+            self._set[campo] = valor
+        self._arrancar_temporizador()
+
+    def observar(self, etapa: str, segundos: float):
+        ms = segundos * 1000
+        with self._lock:
+            for campo, cantidad in (
+                (f"latencias.{etapa}.n", 1),
+                (f"latencias.{etapa}.suma_ms", ms),
+                (f"latencias.{etapa}.cubos.{_cubo(ms)}", 1),
+            ):
+                self._inc[campo] = self._inc.get(campo, 0) + cantidad
+        self._arrancar_temporizador()
+
+    @contextmanager
+    def medir(self, etapa: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, time.perf_counter() - inicio)
+
+    def vaciar(self):
+        """Escribe lo acumulado con un solo upsert; ante un fallo se conserva para el siguiente"""
+        with self._vaciado:
+            with self._lock:
+                inc, self._inc = self._inc, {}
+                valores, self._set = self._set, {}
+            if not inc and not valores:
+                return
+            cambios = {"$setOnInsert": {"first_seen": datetime.now(timezone.utc)}}
+            if inc:
+                cambios["$inc"] = inc
+            if valores:
+                cambios["$set"] = valores
+            try:
+                self._obtener_coleccion().update_one({"_id": self.worker_id()}, cambios, upsert=True)
+            except Exception as e:
+                logger.error(f"No se pudieron escribir las métricas del worker: {e}")
+                with self._lock:
+                    for campo, cantidad in inc.items():
+                        self._inc[campo] = self._inc.get(campo, 0) + cantidad
+                    for campo, valor in valores.items():
+                        self._set.setdefault(campo, valor)
@@ -0,0 +1,118 @@
+import os
+import time
+import hashlib
+import logging
+from datetime import datetime, timezone, timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Reclamación particionada por dominio registrable
+# -------------------------------------------------------------------
+# Con "1" cada worker reclama solo de las particiones que le corresponden
+RECLAMO_PARTICIONADO = os.environ.get("RECLAMO_PARTICIONADO", "0") == "1"
+# Número de particiones (debe coincidir con el importer/enqueuer)
+PARTICIONES = int(os.environ.get("PARTICIONES", "256"))
+# Cada cuánto se recalcula la asignación a partir de los heartbeats
+PARTICION_REFRESCO_SEGUNDOS = int(os.environ.get("PARTICION_REFRESCO_SEGUNDOS", "30"))
+# Un worker sin heartbeat durante este tiempo deja de contar para el reparto
+PARTICION_VIVO_SEGUNDOS = int(os.environ.get("PARTICION_VIVO_SEGUNDOS", "120"))
+# Si las particiones propias no tienen pendientes, reclamar de cualquiera
+PARTICION_ROBAR = os.environ.get("PARTICION_ROBAR", "1") == "1"
+# Documentos sin partición que se completan por pasada de la tarea de mantenimiento
+PARTICION_RELLENO_LOTE = int(os.environ.get("PARTICION_RELLENO_LOTE", "5000"))
+
+# Sufijos de segundo nivel bajo los que se registra (el registrable tiene tres etiquetas)
+SUFIJOS_SEGUNDO_NIVEL = {
+    "com.es", "nom.es", "org.es", "gob.es", "edu.es",
+    "co.uk", "org.uk", "ac.uk", "gov.uk",
+    "com.ar", "com.br", "com.co", "com.mx", "com.pe", "com.uy", "com.ve", "com.au",
+}
+
+
+def _hash(texto: str) -> int:
+    return int(hashlib.sha1(texto.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def dominio_registrable(dominio: str) -> str:
+    """Dominio registrable (p. ej. www.ejemplo.com.es -> ejemplo.com.es)"""
+    etiquetas = dominio.strip().lower().rstrip(".").split(".")
+    if len(etiquetas) >= 3 and ".".join(etiquetas[-2:]) in SUFIJOS_SEGUNDO_NIVEL:
+        return ".".join(etiquetas[-3:])
+    return ".".join(etiquetas[-2:])
+
+
+def clave_particion(dominio: str, particiones: int = PARTICIONES) -> int:
+    return _hash(dominio_registrable(dominio)) % particiones
+
+
+def repartir(workers: list, particiones: int = PARTICIONES) -> dict:
+    """
+    Asigna cada partición a un worker por rendezvous hashing: al entrar o
+    salir un worker solo se mueven las particiones que ganaba o que gana.
+    Devuelve {worker: [particiones]}.
+    """
+    reparto = {w: [] for w in workers}
+    if not workers:
+        return reparto
+    for p in range(particiones):
+        ganador = max(workers, key=lambda w: _hash(f"{w}|{p}"))
+        reparto[ganador].append(p)
+    return reparto
+
+
+class AsignacionParticiones:
+    """
+    Particiones que le tocan a un worker según los workers vivos en
+    worker_stats. Se recalcula cada PARTICION_REFRESCO_SEGUNDOS, de modo que
+    la caída o llegada de un worker rebalancea el reparto sin coordinación.
+    """
+
+    def __init__(self, col_stats, worker_id: str, particiones: int = PARTICIONES,
+                 refresco: int = PARTICION_REFRESCO_SEGUNDOS, vivo: int = PARTICION_VIVO_SEGUNDOS):
+        self._col_stats = col_stats
+        self._worker_id = worker_id
+        self._particiones = particiones
+        self._refresco = refresco
+        self._vivo = timedelta(seconds=vivo)
+        self._propias = None
+        self._miembros = ()
+        self._ultima = 0.0
+
+    def _workers_vivos(self) -> list:
+        limite = datetime.now(timezone.utc) - self._vivo
+        vivos = {d["_id"] for d in self._col_stats.find({"last_heartbeat": {"$gt": limite}}, {"_id": 1})}
+        vivos.add(self._worker_id)
+        return sorted(vivos)
+
+    def propias(self) -> list:
+        if self._propias is None or time.time() - self._ultima >= self._refresco:
+            self._ultima = time.time()
+            try:
+                miembros = tuple(self._workers_vivos())
+            except Exception as e:
+                logger.error(f"No se pudieron leer los workers vivos: {e}")
+                miembros = self._miembros or (self._worker_id,)
+            if miembros != self._miembros:
+                self._propias = repartir(list(miembros), self._particiones)[self._worker_id]
+                self._miembros = miembros
+                logger.warning(
+                    f"🔀 Particiones rebalanceadas: {len(self._propias)}/{self._particiones} "
+                    f"para {self._worker_id} ({len(miembros)} workers)"
+                )
+        return self._propias
+
+
+def rellenar_particiones(col_pendientes, particiones: int = PARTICIONES,
+                         limite: int = PARTICION_RELLENO_LOTE) -> int:
+    """Calcula la partición de los dominios pendientes importados sin ella"""
+    docs = list(col_pendientes.find({"particion": {"$exists": False}}, {"dominio": 1}).limit(limite))
+    if not docs:
+        return 0
+    resultado = col_pendientes.bulk_write([
+        UpdateOne({"_id": d["_id"]}, {"$set": {"particion": clave_particion(d["dominio"], particiones)}})
+        for d in docs
+    ], ordered=False)
+    return resultado.modified_count
@@ -0,0 +1,75 @@
+import os
+import logging
+
+from resolucion import TIPOS_REGISTRO
+from enumeracion import ENUMERADORES_ACTIVOS
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Perfiles de escaneo (rapido / estandar / profundo)
+# -------------------------------------------------------------------
+# Perfil de los dominios sin perfil propio ni argumento de tarea
+PERFIL_POR_DEFECTO = os.environ.get("PERFIL_POR_DEFECTO", "estandar")
+
+
+def _lista(variable: str, defecto: str) -> list:
+    return [n.strip() for n in os.environ.get(variable, defecto).split(",") if n.strip()]
+
+
+# tipos: registros del apex; whois: respaldo whois para IPs fuera de la tabla
+# ASN offline; max_subdominios: tope de subdominios resueltos (0 = sin tope);
+# forzar_enumeracion: no reutilizar la enumeración cacheada del apex
+PERFILES = {
+    "rapido": {
+        "tipos": ["A", "NS"],
+        "whois": False,
+        "enumerar": False,
+        "enumeradores": [],
+        "forzar_enumeracion": False,
+        "max_subdominios": 0,
+    },
+    "estandar": {
+        "tipos": TIPOS_REGISTRO,
+        "whois": True,
+        "enumerar": True,
+        "enumeradores": ENUMERADORES_ACTIVOS,
+        "forzar_enumeracion": False,
+        "max_subdominios": int(os.environ.get("PERFIL_ESTANDAR_MAX_SUBDOMINIOS", "10000")),
+    },
+    "profundo": {
+        "tipos": TIPOS_REGISTRO + _lista("PERFIL_PROFUNDO_TIPOS", "AAAA,CNAME,SOA,CAA"),
+        "whois": True,
+        "enumerar": True,
+        "enumeradores": _lista("PERFIL_PROFUNDO_ENUMERADORES", "subfinder_todas,assetfinder"),
+        "forzar_enumeracion": True,
+        "max_subdominios": int(os.environ.get("PERFIL_PROFUNDO_MAX_SUBDOMINIOS", "100000")),
+    },
+}
+
+# Primeras etiquetas que se resuelven antes que el resto cuando hay que recortar
+PREFIJOS_PRIORITARIOS = {
+    "www", "mail", "correo", "webmail", "smtp", "mx", "autodiscover", "ns1", "ns2",
+    "vpn", "remote", "portal", "intranet", "sede", "api", "app", "admin",
+    "shop", "tienda", "ftp", "dev", "test", "staging",
+}
+
+
+def obtener_perfil(nombre: str = None) -> tuple:
+    """(nombre, configuración) del perfil pedido, o del perfil por defecto"""
+    nombre = nombre or PERFIL_POR_DEFECTO
+    if nombre not in PERFILES:
+        logger.warning(f"Perfil de escaneo desconocido '{nombre}', se usa estandar")
+        nombre = "estandar"
+    return nombre, PERFILES[nombre]
+
+
+def priorizar(subdominios: list, dominio: str) -> list:
+    """
+    Ordena los subdominios por interés: primero los de prefijos conocidos,
+    luego los más cercanos al apex (menos etiquetas) y los más cortos.
+    """
+    def clave(sub):
+        etiquetas = sub[:-len(dominio) - 1].split(".") if sub.endswith(f".{dominio}") else [sub]
+        return (etiquetas[0] not in PREFIJOS_PRIORITARIOS, len(etiquetas), len(sub), sub)
+    return sorted(subdominios, key=clave)
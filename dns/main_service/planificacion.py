@@ -0,0 +1,193 @@
+import os
+import logging
+from datetime import datetime, timezone, timedelta
+
+import pymongo
+from pymongo import UpdateOne
+
+from historico import TIPO_SIN_CAMBIOS, TIPO_DELTA, hash_contenido
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Revisitas adaptativas (procesado_por.<herramienta>_next_scan_at)
+# -------------------------------------------------------------------
+# Límites del intervalo entre escaneos de un mismo dominio
+REVISITA_MIN_HORAS = float(os.environ.get("REVISITA_MIN_HORAS", "6"))
+REVISITA_MAX_DIAS = float(os.environ.get("REVISITA_MAX_DIAS", "60"))
+# Intervalo mientras el histórico no tiene al menos dos escaneos
+REVISITA_INICIAL_HORAS = float(os.environ.get("REVISITA_INICIAL_HORAS", "168"))
+# Fracción del tiempo medio entre cambios que se deja entre escaneos
+REVISITA_FACTOR = float(os.environ.get("REVISITA_FACTOR", "0.5"))
+# Entradas recientes del histórico usadas para estimar la frecuencia de cambios
+REVISITA_VENTANA = int(os.environ.get("REVISITA_VENTANA", "10"))
+REVISITA_HERRAMIENTAS = [
+    h.strip() for h in os.environ.get("REVISITA_HERRAMIENTAS", "main,lynx,certgraph,opendata").split(",") if h.strip()
+]
+# Dominios planificados o reabiertos por herramienta en cada pasada
+REVISITA_LOTE = int(os.environ.get("REVISITA_LOTE", "1000"))
+
+# Colección de resultados de cada colector; main usa dominios_historico
+COLECCIONES_RESULTADOS = {
+    "lynx": "dominios_lynx",
+    "certgraph": "dominios_certgraph",
+    "opendata": "dominios_empresa",
+}
+
+
+def _acotar(segundos: float) -> timedelta:
+    minimo = REVISITA_MIN_HORAS * 3600
+    maximo = REVISITA_MAX_DIAS * 86400
+    return timedelta(seconds=min(maximo, max(minimo, segundos)))
+
+
+def _utc(fecha: datetime) -> datetime:
+    return fecha.replace(tzinfo=timezone.utc) if fecha.tzinfo is None else fecha
+
+
+def huella_resultado(doc: dict) -> str:
+    """Hash del resultado de un colector sin _id, dominio ni marcas de tiempo (fecha_*)"""
+    return hash_contenido({k: v for k, v in doc.items() if k != "dominio" and not k.startswith("fecha")})
+
+
+def intervalo_revisita(entradas: list) -> timedelta:
+    """
+    Intervalo hasta el próximo escaneo a partir de las entradas del histórico
+    [(fecha_consulta, tipo)], de la más reciente a la más antigua.
+
+    El tiempo medio entre cambios se estima como duración de la ventana /
+    (cambios + 0.5): sin cambios observados el intervalo crece con la propia
+    ventana y un dominio que cambia en cada escaneo se acerca al mínimo.
+    """
+    if len(entradas) < 2:
+        return _acotar(REVISITA_INICIAL_HORAS * 3600)
+    duracion = (entradas[0][0] - entradas[-1][0]).total_seconds()
+    if duracion <= 0:
+        return _acotar(REVISITA_INICIAL_HORAS * 3600)
+    # La entrada más antigua no se compara con nada dentro de la ventana
+    cambios = sum(1 for _, tipo in entradas[:-1] if tipo != TIPO_SIN_CAMBIOS)
+    return _acotar(REVISITA_FACTOR * duracion / (cambios + 0.5))
+
+
+class PlanificadorRevisitas:
+    """
+    Calcula el próximo escaneo de un dominio según cuánto cambian sus datos.
+
+    Para main los cambios salen de dominios_historico. Los colectores solo
+    guardan el último resultado, así que cada vez que se planifica uno se
+    compara su huella con la anterior y el resultado (cambio o no) se apunta
+    en procesado_por.<h>_cambios, con las últimas `ventana` entradas.
+    """
+
+    def __init__(self, obtener_historico, obtener_db=None, ventana: int = REVISITA_VENTANA):
+        self._obtener_historico = obtener_historico
+        self._obtener_db = obtener_db
+        self._ventana = max(2, ventana)
+
+    def intervalo(self, dominio: str) -> timedelta:
+        try:
+            entradas = [
+                # Las entradas anteriores al histórico por deltas no tienen tipo: cuentan como cambio
+                (e["fecha_consulta"], e.get("tipo"))
+                for e in self._obtener_historico().find(
+                    {"dominio": dominio}, {"fecha_consulta": 1, "tipo": 1}
+                ).sort("fecha_consulta", pymongo.DESCENDING).limit(self._ventana)
+            ]
+        except Exception as e:
+            logger.error(f"No se pudo leer el histórico de {dominio}: {e}")
+            entradas = []
+        return intervalo_revisita(entradas)
+
+    def siguiente(self, dominio: str, ahora: datetime = None) -> datetime:
+        return (ahora or datetime.now(timezone.utc)) + self.intervalo(dominio)
+
+    def coleccion_resultados(self, herramienta: str):
+        """Colección de resultados del colector, o None si se planifica por dominios_historico"""
+        if self._obtener_db is None or herramienta not in COLECCIONES_RESULTADOS:
+            return None
+        return self._obtener_db()[COLECCIONES_RESULTADOS[herramienta]]
+
+    def operaciones_colector(self, herramienta: str, docs: list, col_resultados, ahora: datetime) -> list:
+        """
+        UpdateOne por dominio de `docs` (de dominios_pendientes) que apunta si
+        el resultado del colector ha cambiado y fija su next_scan_at.
+        """
+        prefijo = f"procesado_por.{herramienta}"
+        try:
+            huellas = {
+                r["dominio"]: huella_resultado(r)
+                for r in col_resultados.find({"dominio": {"$in": [d["dominio"] for d in docs]}})
+            }
+        except Exception as e:
+            logger.error(f"No se pudieron leer los resultados de {herramienta}: {e}")
+            huellas = {}
+        operaciones = []
+        for d in docs:
+            previo = d.get("procesado_por", {})
+            huella = huellas.get(d["dominio"])
+            # La primera entrada no se compara con nada: su valor no cuenta
+            entrada = {"fecha": ahora, "cambio": huella != previo.get(f"{herramienta}_huella")}
+            cambios = (previo.get(f"{herramienta}_cambios") or [])[-(self._ventana - 1):] + [entrada]
+            entradas = [
+                (_utc(c["fecha"]), TIPO_DELTA if c["cambio"] else TIPO_SIN_CAMBIOS)
+                for c in reversed(cambios)
+            ]
+            operaciones.append(UpdateOne(
+                {"_id": d["_id"]},
+                {"$set": {f"{prefijo}_next_scan_at": ahora + intervalo_revisita(entradas),
+                          f"{prefijo}_huella": huella},
+                 "$push": {f"{prefijo}_cambios": {"$each": [entrada], "$slice": -self._ventana}}}
+            ))
+        return operaciones
+
+
+def planificar_revisitas(col_pendientes, planificador: PlanificadorRevisitas, herramientas: list = None,
+                         limite: int = REVISITA_LOTE) -> dict:
+    """
+    Para cada herramienta:
+      - fija <h>_next_scan_at en los dominios terminados que aún no lo tienen
+        (los colectores solo marcan procesado_por.<h> = True), según los
+        cambios de su propio resultado
+      - reabre los dominios cuyo next_scan_at ya ha llegado, limpiando la
+        reclamación y los reintentos anteriores
+    Devuelve {herramienta: {"planificados": n, "reabiertos": n}}.
+    """
+    ahora = datetime.now(timezone.utc)
+    resumen = {}
+    for h in herramientas or REVISITA_HERRAMIENTAS:
+        proximo = f"procesado_por.{h}_next_scan_at"
+        planificados = reabiertos = 0
+
+        col_resultados = planificador.coleccion_resultados(h)
+        sin_fecha = list(col_pendientes.find(
+            {f"procesado_por.{h}": True, proximo: {"$exists": False}},
+            {"dominio": 1, f"procesado_por.{h}_huella": 1, f"procesado_por.{h}_cambios": 1}
+        ).limit(limite))
+        if sin_fecha:
+            if col_resultados is not None:
+                operaciones = planificador.operaciones_colector(h, sin_fecha, col_resultados, ahora)
+            else:
+                operaciones = [
+                    UpdateOne({"_id": d["_id"]}, {"$set": {proximo: planificador.siguiente(d["dominio"], ahora)}})
+                    for d in sin_fecha
+                ]
+            resultado = col_pendientes.bulk_write(operaciones, ordered=False)
+            planificados = resultado.modified_count
+
+        ids = [d["_id"] for d in col_pendientes.find(
+            {f"procesado_por.{h}": True, proximo: {"$lte": ahora}}, {"_id": 1}
+        ).sort(proximo, 1).limit(limite)]
+        if ids:
+            resultado = col_pendientes.update_many(
+                {"_id": {"$in": ids}, f"procesado_por.{h}": True},
+                {"$set": {f"procesado_por.{h}": False},
+                 "$unset": {f"procesado_por.{h}_{campo}": "" for campo in (
+                     "iniciado", "lease", "lease_hasta", "proximo_intento", "intentos", "error"
+                 )}}
+            )
+            reabiertos = resultado.modified_count
+
+        if planificados or reabiertos:
+            resumen[h] = {"planificados": planificados, "reabiertos": reabiertos}
+            logger.warning(f"🗓️ {h}: {planificados} dominios planificados, {reabiertos} reabiertos para revisita")
+    return resumen
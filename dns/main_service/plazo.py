@@ -0,0 +1,51 @@
+import os
+import time
+
+# -------------------------------------------------------------------
+# Presupuesto de tiempo por dominio (plazo compartido entre etapas)
+# -------------------------------------------------------------------
+# Tiempo total de procesar_dominio para un dominio, todas las etapas incluidas
+PLAZO_DOMINIO_SEGUNDOS = float(os.environ.get("PLAZO_DOMINIO_SEGUNDOS", "600"))
+# Margen que la etapa de subdominios deja libre para cerrar y guardar el resultado
+PLAZO_RESERVA_SEGUNDOS = float(os.environ.get("PLAZO_RESERVA_SEGUNDOS", "15"))
+# Tiempo de cada bloque de un dominio repartido (fan-out)
+PLAZO_BLOQUE_SEGUNDOS = float(os.environ.get("PLAZO_BLOQUE_SEGUNDOS", "300"))
+
+
+class Plazo:
+    """
+    Instante límite compartido por las etapas de un escaneo. Cada etapa toma
+    su tiempo de lo que queda (restante/limitar) y, si se queda sin él,
+    cancela lo pendiente y se anota en `truncados`.
+
+    `fin` es absoluto (epoch), de modo que el plazo puede pasarse a otra tarea.
+    """
+
+    def __init__(self, segundos: float = None, fin: float = None, truncados: list = None):
+        if fin is None:
+            fin = time.time() + (PLAZO_DOMINIO_SEGUNDOS if segundos is None else segundos)
+        self.fin = fin
+        self.truncados = truncados if truncados is not None else []
+
+    @classmethod
+    def crear(cls, plazo=None):
+        """Acepta un Plazo, un número de segundos o None (PLAZO_DOMINIO_SEGUNDOS)"""
+        return plazo if isinstance(plazo, Plazo) else cls(plazo)
+
+    def restante(self) -> float:
+        return max(0.0, self.fin - time.time())
+
+    def agotado(self) -> bool:
+        return self.restante() <= 0
+
+    def limitar(self, segundos: float) -> float:
+        """`segundos`, recortado a lo que queda del plazo"""
+        return min(segundos, self.restante())
+
+    def reservar(self, segundos: float):
+        """Plazo que termina `segundos` antes (comparte las etapas truncadas)"""
+        return Plazo(fin=self.fin - segundos, truncados=self.truncados)
+
+    def truncar(self, etapa: str):
+        if etapa not in self.truncados:
+            self.truncados.append(etapa)
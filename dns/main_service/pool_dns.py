@@ -0,0 +1,218 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Pool de resolvers upstream con estadísticas por servidor
+# -------------------------------------------------------------------
+# Servidores "ip" o "ip:puerto" separados por comas; vacío = resolver del sistema
+DNS_UPSTREAMS = [s.strip() for s in os.environ.get("DNS_UPSTREAMS", "").split(",") if s.strip()]
+# Consultas por segundo máximas por servidor y proceso (0 = sin límite)
+DNS_UPSTREAM_QPS = float(os.environ.get("DNS_UPSTREAM_QPS", "0"))
+# Errores seguidos (timeouts, fallos de red) que apartan un servidor del pool
+DNS_EXPULSION_ERRORES = int(os.environ.get("DNS_EXPULSION_ERRORES", "5"))
+DNS_EXPULSION_SEGUNDOS = float(os.environ.get("DNS_EXPULSION_SEGUNDOS", "30"))
+# Espera por intento en un servidor y total de la consulta (reintentando en otros)
+DNS_TIMEOUT = float(os.environ.get("DNS_TIMEOUT", "2"))
+DNS_LIFETIME = float(os.environ.get("DNS_LIFETIME", "5"))
+
+# Suavizado de las medias móviles de latencia y de tasa de error
+_ALFA_LATENCIA = 0.2
+_ALFA_ERROR = 0.1
+
+
+def _fallo_del_servidor(error) -> bool:
+    """Si un NoNameservers viene de la red o de un REFUSED (y no de un SERVFAIL del dominio)"""
+    for _, _, _, causa, _ in error.kwargs.get("errors") or []:
+        if isinstance(causa, Exception) or causa == "REFUSED":
+            return True
+    return False
+
+
+class Upstream:
+    """Un servidor del pool: su resolver, sus estadísticas y su cupo de consultas"""
+
+    def __init__(self, nombre: str, resolver, qps: float = DNS_UPSTREAM_QPS):
+        self.nombre = nombre
+        self.resolver = resolver
+        self._qps = qps
+        self._fichas = max(1.0, qps)
+        self._recarga = time.monotonic()
+        self._lock = threading.Lock()
+        self.latencia = None
+        self.tasa_error = 0.0
+        self.errores_seguidos = 0
+        self.expulsado_hasta = 0.0
+        self.consultas = 0
+        self.errores = 0
+
+    def disponible(self, ahora: float) -> bool:
+        return ahora >= self.expulsado_hasta
+
+    def peso(self) -> float:
+        """Más peso cuanto menor es la latencia y la tasa de error"""
+        return 1.0 / ((self.latencia or 0.05) * (1 + 10 * self.tasa_error))
+
+    def _recargar(self, ahora: float):
+        if self._qps > 0:
+            self._fichas = min(max(1.0, self._qps), self._fichas + (ahora - self._recarga) * self._qps)
+            self._recarga = ahora
+
+    def tomar_ficha(self, ahora: float) -> bool:
+        if self._qps <= 0:
+            return True
+        with self._lock:
+            self._recargar(ahora)
+            if self._fichas >= 1:
+                self._fichas -= 1
+                return True
+            return False
+
+    def espera_ficha(self, ahora: float) -> float:
+        if self._qps <= 0:
+            return 0.0
+        with self._lock:
+            self._recargar(ahora)
+            return max(0.0, (1 - self._fichas) / self._qps)
+
+    def registrar_exito(self, segundos: float):
+        with self._lock:
+            self.consultas += 1
+            self.errores_seguidos = 0
+            self.latencia = segundos if self.latencia is None else (
+                _ALFA_LATENCIA * segundos + (1 - _ALFA_LATENCIA) * self.latencia
+            )
+            self.tasa_error *= 1 - _ALFA_ERROR
+
+    def registrar_error(self, motivo: str):
+        with self._lock:
+            self.consultas += 1
+            self.errores += 1
+            self.tasa_error = _ALFA_ERROR + (1 - _ALFA_ERROR) * self.tasa_error
+            ahora = time.monotonic()
+            if ahora < self.expulsado_hasta:
+                # Consultas que ya estaban en vuelo al expulsarlo: no alargan la expulsión
+                return
+            self.errores_seguidos += 1
+            expulsar = self.errores_seguidos >= DNS_EXPULSION_ERRORES
+            if expulsar:
+                self.errores_seguidos = 0
+                self.expulsado_hasta = ahora + DNS_EXPULSION_SEGUNDOS
+        if expulsar:
+            logger.warning(f"🚫 Resolver {self.nombre} fuera del pool {DNS_EXPULSION_SEGUNDOS:.0f}s: {motivo}")
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {
+                "servidor": self.nombre,
+                "consultas": self.consultas,
+                "errores": self.errores,
+                "latencia_ms": round(self.latencia * 1000, 1) if self.latencia is not None else None,
+                "tasa_error": round(self.tasa_error, 3),
+                "expulsado": time.monotonic() < self.expulsado_hasta,
+            }
+
+
+class PoolResolvers:
+    """
+    Reparte las consultas entre varios resolvers upstream con el mismo
+    interfaz que dns.asyncresolver.Resolver.resolve.
+
+    Cada consulta elige servidor al azar ponderando por latencia y tasa de
+    error (medias móviles por servidor); si el intento agota DNS_TIMEOUT o
+    falla la red, se reintenta en otro hasta agotar el lifetime. Un servidor
+    con DNS_EXPULSION_ERRORES errores seguidos sale del pool durante
+    DNS_EXPULSION_SEGUNDOS. Con DNS_UPSTREAM_QPS, cada servidor tiene un cupo
+    de consultas por segundo y, si todos lo han gastado, la consulta espera.
+
+    NXDOMAIN, NoAnswer y SERVFAIL son respuestas del dominio, no del servidor:
+    cuentan como consulta buena. Un REFUSED sí cuenta como error del servidor.
+    Con `reintentos_servfail`, un SERVFAIL se repite en otro servidor antes de
+    darlo por bueno.
+    """
+
+    def __init__(self, upstreams: list, timeout: float = DNS_TIMEOUT, lifetime: float = DNS_LIFETIME):
+        self._upstreams = upstreams
+        self.timeout = timeout
+        self.lifetime = lifetime
+
+    @classmethod
+    def desde_entorno(cls):
+        if not DNS_UPSTREAMS:
+            resolver = dns.asyncresolver.Resolver()
+            resolver.timeout = DNS_TIMEOUT
+            resolver.lifetime = DNS_TIMEOUT
+            return cls([Upstream("sistema", resolver)])
+        upstreams = []
+        for servidor in DNS_UPSTREAMS:
+            ip, _, puerto = servidor.partition(":")
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.nameservers = [ip]
+            resolver.port = int(puerto or 53)
+            resolver.timeout = DNS_TIMEOUT
+            resolver.lifetime = DNS_TIMEOUT
+            upstreams.append(Upstream(servidor, resolver))
+        return cls(upstreams)
+
+    async def _elegir(self, probados: set, fin: float) -> Upstream:
+        while True:
+            ahora = time.monotonic()
+            disponibles = [u for u in self._upstreams if u.disponible(ahora)]
+            if not disponibles:
+                # Todos expulsados: el que vuelve antes
+                disponibles = [min(self._upstreams, key=lambda u: u.expulsado_hasta)]
+            candidatos = [u for u in disponibles if u not in probados] or disponibles
+            con_cupo = [u for u in candidatos if u.espera_ficha(ahora) == 0]
+            if con_cupo:
+                elegido = random.choices(con_cupo, weights=[u.peso() for u in con_cupo])[0]
+                if elegido.tomar_ficha(ahora):
+                    return elegido
+                continue
+            espera = min(u.espera_ficha(ahora) for u in candidatos)
+            if ahora + espera >= fin:
+                raise dns.exception.Timeout()
+            await asyncio.sleep(espera)
+
+    async def resolve(self, nombre: str, tipo: str, lifetime: float = None, reintentos_servfail: int = 0):
+        fin = time.monotonic() + (self.lifetime if lifetime is None else lifetime)
+        probados = set()
+        while True:
+            restante = fin - time.monotonic()
+            if restante <= 0:
+                raise dns.exception.Timeout()
+            upstream = await self._elegir(probados, fin)
+            probados.add(upstream)
+            inicio = time.monotonic()
+            try:
+                respuesta = await upstream.resolver.resolve(
+                    nombre, tipo, lifetime=min(self.timeout, max(0.0, fin - inicio))
+                )
+            except (dns.exception.Timeout, OSError) as e:
+                upstream.registrar_error(type(e).__name__)
+                continue
+            except dns.resolver.NoNameservers as e:
+                if _fallo_del_servidor(e):
+                    upstream.registrar_error("sin respuesta válida")
+                    continue
+                upstream.registrar_exito(time.monotonic() - inicio)
+                if reintentos_servfail > 0:
+                    reintentos_servfail -= 1
+                    continue
+                raise
+            except Exception:
+                upstream.registrar_exito(time.monotonic() - inicio)
+                raise
+            upstream.registrar_exito(time.monotonic() - inicio)
+            return respuesta
+
+    def estadisticas(self) -> list:
+        return [u.estadisticas() for u in self._upstreams]
@@ -0,0 +1,228 @@
+import os
+import uuid
+import threading
+import logging
+from datetime import datetime, timezone, timedelta
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# -------------------------------------------------------------------
+# Reclamación de dominios por lotes con lease (dominios_pendientes)
+# -------------------------------------------------------------------
+# Dominios reclamados por viaje a Mongo
+RECLAMO_LOTE = int(os.environ.get("RECLAMO_LOTE", "8"))
+# Duración del lease; se renueva mientras el dominio sigue en proceso
+LEASE_SEGUNDOS = int(os.environ.get("LEASE_SEGUNDOS", "600"))
+
+# Reintentos: espera base * 2^(intento-1), con tope; tras REINTENTOS_MAX pasa a dead-letter
+REINTENTOS_MAX = int(os.environ.get("REINTENTOS_MAX", "5"))
+REINTENTO_BASE_SEGUNDOS = int(os.environ.get("REINTENTO_BASE_SEGUNDOS", "60"))
+REINTENTO_TOPE_SEGUNDOS = int(os.environ.get("REINTENTO_TOPE_SEGUNDOS", "86400"))
+
+# Recolector de reclamaciones caducadas
+REAPER_HERRAMIENTAS = [
+    h.strip() for h in os.environ.get("REAPER_HERRAMIENTAS", "main,lynx,certgraph,opendata").split(",") if h.strip()
+]
+# Reclamaciones sin lease (colectores) que se dan por perdidas pasado este tiempo
+REAPER_SIN_LEASE_SEGUNDOS = int(os.environ.get("REAPER_SIN_LEASE_SEGUNDOS", "3600"))
+# Un worker sin heartbeat en worker_stats durante este tiempo se da por muerto
+HEARTBEAT_CADUCADO_SEGUNDOS = int(os.environ.get("HEARTBEAT_CADUCADO_SEGUNDOS", "1800"))
+REAPER_LOTE = int(os.environ.get("REAPER_LOTE", "1000"))
+
+
+def filtro_pendientes(herramienta: str, ahora: datetime = None) -> dict:
+    """Dominios que `herramienta` puede reclamar (respeta la espera entre reintentos y el dead-letter)"""
+    ahora = ahora or datetime.now(timezone.utc)
+    return {
+        f"procesado_por.{herramienta}": {"$ne": True},
+        f"procesado_por.{herramienta}_iniciado": {"$exists": False},
+        f"procesado_por.{herramienta}_dead_letter": {"$exists": False},
+        "$or": [
+            {f"procesado_por.{herramienta}_proximo_intento": {"$exists": False}},
+            {f"procesado_por.{herramienta}_proximo_intento": {"$lte": ahora}}
+        ]
+    }
+
+
+def operacion_reintento(herramienta: str, doc: dict, motivo: str, ahora: datetime = None) -> UpdateOne:
+    """
+    Devuelve a la cola un dominio reclamado que falló o cuyo lease caducó:
+    suma un intento y fija el siguiente con espera exponencial, o lo pasa a
+    dead-letter al llegar a REINTENTOS_MAX (los filtros de reclamación
+    excluyen <h>_dead_letter; además conserva _iniciado). Solo actúa si la reclamación sigue siendo la misma.
+    """
+    ahora = ahora or datetime.now(timezone.utc)
+    h = herramienta
+    pp = doc.get("procesado_por") or {}
+    intentos = pp.get(f"{h}_intentos", 0) + 1
+
+    filtro = {"_id": doc["_id"], f"procesado_por.{h}": {"$ne": True}}
+    if pp.get(f"{h}_lease"):
+        filtro[f"procesado_por.{h}_lease"] = pp[f"{h}_lease"]
+    else:
+        filtro[f"procesado_por.{h}_iniciado"] = pp.get(f"{h}_iniciado")
+
+    cambios = {f"procesado_por.{h}_intentos": intentos, f"procesado_por.{h}_error": motivo}
+    eliminar = {f"procesado_por.{h}_lease": "", f"procesado_por.{h}_lease_hasta": ""}
+    if intentos >= REINTENTOS_MAX:
+        cambios[f"procesado_por.{h}_dead_letter"] = ahora
+    else:
+        espera = min(REINTENTO_TOPE_SEGUNDOS, REINTENTO_BASE_SEGUNDOS * 2 ** (intentos - 1))
+        cambios[f"procesado_por.{h}_proximo_intento"] = ahora + timedelta(seconds=espera)
+        eliminar[f"procesado_por.{h}_iniciado"] = ""
+    return UpdateOne(filtro, {"$set": cambios, "$unset": eliminar})
+
+
+def recuperar_reclamaciones(col_pendientes, col_stats, herramientas: list = None,
+                            limite: int = REAPER_LOTE) -> dict:
+    """
+    Busca reclamaciones perdidas de cada herramienta y las devuelve a la cola
+    (o a dead-letter) con operacion_reintento:
+      - lease caducado (workers que reclaman con ReclamadorLotes)
+      - reclamación sin lease más antigua que REAPER_SIN_LEASE_SEGUNDOS
+      - main: worker sin heartbeat reciente en worker_stats
+    Devuelve {herramienta: dominios recuperados}.
+    """
+    ahora = datetime.now(timezone.utc)
+    limite_heartbeat = ahora - timedelta(seconds=HEARTBEAT_CADUCADO_SEGUNDOS)
+    vivos = [d["_id"] for d in col_stats.find({"last_heartbeat": {"$gt": limite_heartbeat}}, {"_id": 1})]
+
+    resumen = {}
+    for h in herramientas or REAPER_HERRAMIENTAS:
+        caducadas = [
+            {f"procesado_por.{h}_lease_hasta": {"$lt": ahora}},
+            {f"procesado_por.{h}_lease_hasta": {"$exists": False},
+             f"procesado_por.{h}_iniciado": {"$lt": ahora - timedelta(seconds=REAPER_SIN_LEASE_SEGUNDOS)}}
+        ]
+        if h == "main":
+            # Solo main registra worker_id y heartbeats
+            caducadas.append({
+                "procesado_por.worker_id": {"$nin": vivos},
+                f"procesado_por.{h}_iniciado": {"$lt": limite_heartbeat}
+            })
+        filtro = {
+            f"procesado_por.{h}": {"$ne": True},
+            f"procesado_por.{h}_iniciado": {"$exists": True},
+            f"procesado_por.{h}_dead_letter": {"$exists": False},
+            "$or": caducadas
+        }
+        docs = list(col_pendientes.find(filtro, {"procesado_por": 1}).limit(limite))
+        if not docs:
+            continue
+        operaciones = [operacion_reintento(h, d, "reclamación caducada", ahora) for d in docs]
+        resultado = col_pendientes.bulk_write(operaciones, ordered=False)
+        resumen[h] = resultado.modified_count
+        logger.warning(f"♻️ {resultado.modified_count} reclamaciones caducadas de {h} devueltas a la cola")
+    return resumen
+
+
+class ReclamadorLotes:
+    """
+    Reclama de una vez hasta `lote` dominios pendientes para una herramienta.
+
+    Cada reclamación marca los documentos con procesado_por.<h>_iniciado, el
+    worker, un token de lease y procesado_por.<h>_lease_hasta. La marca se hace
+    con un update_many condicionado al mismo filtro de pendientes, así que dos
+    workers nunca se quedan el mismo documento: el que llega tarde simplemente
+    recibe menos. Los dominios en curso se renuevan con renovar() (o con el
+    hilo de iniciar_renovacion()) hasta que se sueltan con liberar().
+
+    Con una AsignacionParticiones solo se reclama de las particiones propias;
+    si están vacías y `robar` está activo, de cualquiera.
+    """
+
+    def __init__(self, col_pendientes, herramienta: str, worker_id: str,
+                 lote: int = RECLAMO_LOTE, lease_segundos: int = LEASE_SEGUNDOS,
+                 asignacion=None, robar: bool = True):
+        self._col = col_pendientes
+        self._asignacion = asignacion
+        self._robar = robar
+        self._h = herramienta
+        self._worker_id = worker_id
+        self._lote = max(1, lote)
+        self._lease = timedelta(seconds=lease_segundos)
+        self._en_curso = set()
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def reclamar(self, cantidad: int = None) -> list:
+        """Reclama hasta `cantidad` (por defecto el lote) dominios; devuelve sus documentos"""
+        cantidad = min(cantidad or self._lote, self._lote)
+        filtro = filtro_pendientes(self._h)
+        # Primero los nunca escaneados (sin fecha) y después los revisitas más atrasados
+        orden = [(f"procesado_por.{self._h}_next_scan_at", 1), ("_id", 1)]
+        ids = []
+        if self._asignacion is not None:
+            propio = {**filtro, "particion": {"$in": self._asignacion.propias()}}
+            ids = [d["_id"] for d in self._col.find(propio, {"_id": 1}).sort(orden).limit(cantidad)]
+            if ids or not self._robar:
+                filtro = propio
+        if not ids and (self._asignacion is None or self._robar):
+            ids = [d["_id"] for d in self._col.find(filtro, {"_id": 1}).sort(orden).limit(cantidad)]
+        if not ids:
+            return []
+
+        ahora = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+        self._col.update_many(
+            {"_id": {"$in": ids}, **filtro},
+            {"$set": {
+                f"procesado_por.{self._h}_iniciado": ahora,
+                f"procesado_por.{self._h}_lease": token,
+                f"procesado_por.{self._h}_lease_hasta": ahora + self._lease,
+                "procesado_por.worker_id": self._worker_id
+            }}
+        )
+        docs = list(self._col.find({f"procesado_por.{self._h}_lease": token}).sort(orden))
+        with self._lock:
+            self._en_curso.update(d["_id"] for d in docs)
+        return docs
+
+    def renovar(self) -> int:
+        """Extiende el lease de los dominios en curso; devuelve cuántos se renovaron"""
+        with self._lock:
+            ids = list(self._en_curso)
+        if not ids:
+            return 0
+        resultado = self._col.update_many(
+            {"_id": {"$in": ids}, "procesado_por.worker_id": self._worker_id},
+            {"$set": {f"procesado_por.{self._h}_lease_hasta": datetime.now(timezone.utc) + self._lease}}
+        )
+        return resultado.modified_count
+
+    def fallo(self, doc: dict, motivo: str):
+        """Programa el reintento de un dominio reclamado cuyo procesamiento falló"""
+        self._col.bulk_write([operacion_reintento(self._h, doc, motivo)])
+        self.liberar(doc["_id"])
+
+    def liberar(self, doc_id):
+        """Deja de renovar un dominio (terminado o fallido)"""
+        with self._lock:
+            self._en_curso.discard(doc_id)
+
+    def en_curso(self) -> int:
+        with self._lock:
+            return len(self._en_curso)
+
+    def _bucle_renovacion(self):
+        intervalo = max(1.0, self._lease.total_seconds() / 3)
+        while not self._parar.wait(intervalo):
+            try:
+                self.renovar()
+            except Exception as e:
+                logger.error(f"No se pudieron renovar los leases de {self._worker_id}: {e}")
+
+    def iniciar_renovacion(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._parar.clear()
+            self._hilo = threading.Thread(target=self._bucle_renovacion, daemon=True)
+            self._hilo.start()
+
+    def detener_renovacion(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=5)
+            self._hilo = None
@@ -0,0 +1,232 @@
+import os
+import random
+import string
+import asyncio
+
+import dns.exception
+import dns.resolver
+
+from pool_dns import PoolResolvers
+
+# -------------------------------------------------------------------
+# Motor de resolución DNS concurrente (asyncio)
+# -------------------------------------------------------------------
+TIPOS_REGISTRO = ["A", "MX", "NS", "TXT"]
+
+# Límite de consultas DNS simultáneas por proceso
+MAX_CONSULTAS_EN_VUELO = int(os.environ.get("DNS_MAX_EN_VUELO", "64"))
+# Límite de registros de IPs en ip_info (whois/geo) simultáneos por proceso
+MAX_ENRIQUECIMIENTOS = int(os.environ.get("DNS_MAX_ENRIQUECIMIENTOS", "8"))
+
+# Detección de wildcard: sondas aleatorias bajo el apex
+WILDCARD_SONDAS = int(os.environ.get("WILDCARD_SONDAS", "3"))
+# colapsar: una entrada "*.apex" con el nº de coincidencias; omitir: se descartan; off: sin detección
+WILDCARD_MODO = os.environ.get("WILDCARD_MODO", "colapsar")
+
+# Estados de la comprobación previa del apex (NS/SOA)
+ESTADO_ACTIVO = "activo"
+ESTADO_NXDOMAIN = "nxdomain"
+ESTADO_SERVFAIL = "servfail"
+ESTADO_SIN_DELEGACION = "sin_delegacion"
+ESTADOS_MUERTOS = (ESTADO_NXDOMAIN, ESTADO_SERVFAIL, ESTADO_SIN_DELEGACION)
+
+# Pool de upstreams (DNS_UPSTREAMS); sin configurar, el resolver del sistema
+_resolver = PoolResolvers.desde_entorno()
+
+
+def estadisticas_resolvers() -> list:
+    """Latencia, errores y expulsión de cada upstream en este proceso"""
+    return _resolver.estadisticas()
+
+
+def normalizar_respuesta(tipo: str, answers) -> list:
+    """
+    Convierte una respuesta de dnspython en valores simples (serializables),
+    ordenados para que el mismo rrset dé siempre la misma lista.
+    """
+    valores = []
+    for r in answers:
+        if tipo == "A":
+            valores.append(str(r))
+        elif tipo == "MX":
+            valores.append([r.exchange.to_text().rstrip('.'), r.preference])
+        elif tipo == "NS":
+            valores.append(r.to_text().rstrip('.'))
+        elif tipo == "TXT":
+            valores.append(b" ".join(r.strings).decode(errors="ignore"))
+        else:
+            valores.append(r.to_text())
+    return sorted(valores)
+
+
+class MotorResolucion:
+    """
+    Resuelve registros DNS de forma concurrente.
+
+    Todas las consultas (tipos de registro y hosts de MX/NS) se lanzan a la vez,
+    limitadas por un semáforo de consultas en vuelo. Los registros solo llevan
+    la IP: su info ASN/geo se entrega a `registrar_ip` (colección ip_info).
+    Las consultas y los registros de IP repetidos dentro de una misma
+    ejecución se comparten.
+    Si se pasa una cache (CacheDNS), las respuestas se buscan primero en ella.
+    Con un plazo (plazo.Plazo), ninguna consulta espera más de lo que le queda
+    y resolver_registros deja fuera los tipos que no terminan a tiempo
+    (`truncado` queda a True).
+    Debe crearse dentro del bucle de eventos que lo usa.
+    """
+
+    def __init__(self, registrar_ip, cache=None, max_en_vuelo: int = MAX_CONSULTAS_EN_VUELO,
+                 max_enriquecimientos: int = MAX_ENRIQUECIMIENTOS, plazo=None):
+        self._registrar_ip = registrar_ip
+        self._cache = cache
+        self._plazo = plazo
+        self.truncado = False
+        self._sem_dns = asyncio.Semaphore(max_en_vuelo)
+        self._sem_enriquecer = asyncio.Semaphore(max_enriquecimientos)
+        self._consultas = {}
+        self._registradas = {}
+
+    def _lifetime(self):
+        """Duración máxima de la próxima consulta (None = la del resolver)"""
+        if self._plazo is None:
+            return None
+        restante = self._plazo.restante()
+        if restante <= 0:
+            raise dns.exception.Timeout()
+        return min(_resolver.lifetime, restante)
+
+    async def _consultar_upstream(self, nombre: str, tipo: str, guardar: bool = True) -> list:
+        try:
+            async with self._sem_dns:
+                answers = await _resolver.resolve(nombre, tipo, lifetime=self._lifetime())
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            if guardar and self._cache is not None:
+                await asyncio.to_thread(self._cache.guardar, nombre, tipo, [])
+            raise
+        valores = normalizar_respuesta(tipo, answers)
+        if guardar and self._cache is not None:
+            await asyncio.to_thread(self._cache.guardar, nombre, tipo, valores, answers.rrset.ttl)
+        return valores
+
+    async def _consultar(self, nombre: str, tipo: str) -> list:
+        if self._cache is not None:
+            valores = self._cache.obtener_local(nombre, tipo)
+            if valores is None:
+                valores = await asyncio.to_thread(self._cache.obtener_compartida, nombre, tipo)
+            if valores is not None:
+                return valores
+        return await self._consultar_upstream(nombre, tipo)
+
+    async def consultar(self, nombre: str, tipo: str) -> list:
+        """Valores de un registro; lista vacía ante cualquier error"""
+        clave = (nombre, tipo)
+        if clave not in self._consultas:
+            self._consultas[clave] = asyncio.ensure_future(self._consultar(nombre, tipo))
+        try:
+            return await asyncio.shield(self._consultas[clave])
+        except Exception:
+            return []
+
+    async def _registrar(self, ip: str):
+        async with self._sem_enriquecer:
+            await asyncio.to_thread(self._registrar_ip, ip)
+
+    async def enriquecer(self, ip: str) -> dict:
+        """Registro de una IP ({"ip": ip}); su info queda en ip_info"""
+        if ip not in self._registradas:
+            self._registradas[ip] = asyncio.ensure_future(self._registrar(ip))
+        try:
+            await asyncio.shield(self._registradas[ip])
+        except Exception:
+            pass
+        return {"ip": ip}
+
+    async def comprobar_vida(self, dominio: str) -> str:
+        """
+        Clasifica el apex con una consulta NS (y SOA si no hay NS), sin cache:
+        nxdomain, servfail (ningún servidor responde, también al repetir la
+        consulta en otro upstream), sin_delegacion (el nombre existe pero no es
+        una zona) o activo. Los timeouts y demás errores
+        cuentan como activo para no descartar dominios por fallos transitorios.
+        """
+        for tipo in ("NS", "SOA"):
+            try:
+                async with self._sem_dns:
+                    await _resolver.resolve(dominio, tipo, lifetime=self._lifetime(), reintentos_servfail=1)
+                return ESTADO_ACTIVO
+            except dns.resolver.NXDOMAIN:
+                return ESTADO_NXDOMAIN
+            except dns.resolver.NoNameservers:
+                return ESTADO_SERVFAIL
+            except dns.resolver.NoAnswer:
+                continue
+            except Exception:
+                return ESTADO_ACTIVO
+        return ESTADO_SIN_DELEGACION
+
+    async def resolver_ips(self, host: str) -> list:
+        ips = await self.consultar(host, "A")
+        return list(await asyncio.gather(*(self.enriquecer(ip) for ip in ips)))
+
+    async def _resolver_tipo(self, dominio: str, tipo: str) -> list:
+        valores = await self.consultar(dominio, tipo)
+        if tipo in ("A", "AAAA"):
+            return list(await asyncio.gather(*(self.enriquecer(ip) for ip in valores)))
+        if tipo == "MX":
+            ips = await asyncio.gather(*(self.resolver_ips(ex) for ex, _ in valores))
+            return [
+                {"exchange": ex, "preference": pref, "ips": mx_ips}
+                for (ex, pref), mx_ips in zip(valores, ips)
+            ]
+        if tipo == "NS":
+            ips = await asyncio.gather(*(self.resolver_ips(host) for host in valores))
+            return [{"ns_host": host, "ips": ns_ips} for host, ns_ips in zip(valores, ips)]
+        if tipo == "TXT":
+            return [{"txt": txt} for txt in valores]
+        return [{"valor": valor} for valor in valores]
+
+    async def resolver_registros(self, dominio: str, tipos=TIPOS_REGISTRO) -> dict:
+        """Mismo formato que resolver_registros_dns (sin tipos vacíos ni sin terminar)"""
+        tareas = [asyncio.ensure_future(self._resolver_tipo(dominio, t)) for t in tipos]
+        if not tareas:
+            return {}
+        timeout = self._plazo.restante() if self._plazo is not None else None
+        hechas, pendientes = await asyncio.wait(tareas, timeout=timeout)
+        if pendientes:
+            for tarea in pendientes:
+                tarea.cancel()
+            await asyncio.gather(*pendientes, return_exceptions=True)
+            self.truncado = True
+        return {t: tarea.result() for t, tarea in zip(tipos, tareas) if tarea in hechas and tarea.result()}
+
+    async def detectar_wildcard(self, dominio: str, sondas: int = WILDCARD_SONDAS):
+        """
+        Resuelve etiquetas aleatorias bajo el apex. Si responden, devuelve la
+        huella del wildcard {"ips": set, "dns": registros de una sonda}; si no, None.
+        Las sondas no pasan por la cache para no llenarla de nombres basura.
+        """
+        nombres = [
+            "".join(random.choices(string.ascii_lowercase + string.digits, k=16)) + f".{dominio}"
+            for _ in range(sondas)
+        ]
+
+        async def sondear(nombre):
+            try:
+                return await self._consultar_upstream(nombre, "A", guardar=False)
+            except Exception:
+                return []
+
+        respuestas = await asyncio.gather(*(sondear(n) for n in nombres))
+        if not any(respuestas):
+            return None
+        ips = set().union(*respuestas)
+        sonda = next(n for n, r in zip(nombres, respuestas) if r)
+        return {"ips": ips, "dns": await self.resolver_registros(sonda)}
+
+    async def resolver_subdominio(self, sub: str, wildcard: dict = None):
+        """Registros de un subdominio, o None si su respuesta A es la del wildcard"""
+        if wildcard:
+            ips = await self.consultar(sub, "A")
+            if ips and set(ips) <= wildcard["ips"]:
+                return None
+        return await self.resolver_registros(sub)
@@ -1,18 +1,48 @@
 import os
-import csv
-import ipaddress
+import json
+import atexit
+import asyncio
+import tempfile
 import subprocess
 import socket
+import ipaddress
 import ssl
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timezone, timedelta
 import time
 
-import dns.resolver
 import pymongo
 import requests
-from celery import Celery
+from celery import Celery, group
+from celery.signals import worker_process_init, worker_process_shutdown
 from ipwhois import IPWhois
+from ipwhois.exceptions import IPDefinedError, WhoisRateLimitError, HTTPRateLimitError
+
+from geoip import IndiceGeoIP
+from asn_offline import TablaASN, ASN_WHOIS_FALLBACK
+from cache_asn import CacheASN
+from circuito import Circuito, CircuitoAbierto, CIRCUITO_COMPARTIDO
+from ip_info import RegistroIPInfo, FUENTE_WHOIS, FUENTE_OFFLINE
+from cache_dns import CacheDNS, CACHE_DNS_ACTIVA
+from escritura import BufferEscritura, EscritorSubdominios, combinar_hashes
+from historico import preparar_entrada
+from metricas import AgregadorMetricas
+from perfiles import obtener_perfil, priorizar
+from plazo import Plazo, PLAZO_RESERVA_SEGUNDOS, PLAZO_BLOQUE_SEGUNDOS
+from planificacion import PlanificadorRevisitas, planificar_revisitas as _planificar_revisitas
+from reclamacion import ReclamadorLotes, recuperar_reclamaciones
+from particiones import (
+    AsignacionParticiones, rellenar_particiones, RECLAMO_PARTICIONADO, PARTICION_ROBAR
+)
+from resolucion import (
+    MotorResolucion, estadisticas_resolvers,
+    TIPOS_REGISTRO, WILDCARD_MODO, ESTADO_ACTIVO, ESTADO_SERVFAIL, ESTADOS_MUERTOS
+)
+from enumeracion import (
+    enumerar_streaming, CacheEnumeracion,
+    SUBFINDER_STREAMING, SUBFINDER_TIMEOUT, SUBFINDER_LOTE, SUBFINDER_LOTE_TIMEOUT
+)
 
 import logging
 
@@ -22,6 +52,28 @@ logger = logging.getLogger(__name__)
 
 MONGO_URI = os.environ.get("MONGO_URI")
 
+# Dominios procesados a la vez por cada proceso worker (cola local)
+MAIN_PARALELISMO = int(os.environ.get("MAIN_PARALELISMO", "4"))
+# Duración máxima de una pasada de distribuir_dominios antes de reprogramarse
+DISTRIBUIR_MAX_SEGUNDOS = int(os.environ.get("DISTRIBUIR_MAX_SEGUNDOS", "300"))
+# Cada cuántos segundos se actualiza el heartbeat durante una pasada
+HEARTBEAT_SEGUNDOS = int(os.environ.get("HEARTBEAT_SEGUNDOS", "30"))
+
+# Fan-out: los subdominios que pasen de FANOUT_UMBRAL se reparten en bloques
+# de FANOUT_BLOQUE entre los workers de main_queue
+FANOUT_SUBDOMINIOS = os.environ.get("FANOUT_SUBDOMINIOS", "1") == "1"
+FANOUT_UMBRAL = int(os.environ.get("FANOUT_UMBRAL", "500"))
+FANOUT_BLOQUE = int(os.environ.get("FANOUT_BLOQUE", "200"))
+# Lease del dominio mientras sus bloques están en vuelo
+FANOUT_LEASE_SEGUNDOS = int(os.environ.get("FANOUT_LEASE_SEGUNDOS", "3600"))
+
+# Comprobación previa NS/SOA del apex: los dominios muertos no se resuelven ni enumeran
+COMPROBAR_VIDA = os.environ.get("COMPROBAR_VIDA", "1") == "1"
+# Días hasta la siguiente visita de un dominio muerto (nxdomain, sin_delegacion)
+DOMINIO_MUERTO_REVISITA_DIAS = float(os.environ.get("DOMINIO_MUERTO_REVISITA_DIAS", "30"))
+# Un servfail puede ser un fallo pasajero de la zona: se revisita antes
+DOMINIO_SERVFAIL_REVISITA_HORAS = float(os.environ.get("DOMINIO_SERVFAIL_REVISITA_HORAS", "24"))
+
 # Implementación de conexión lazy para evitar problemas con fork en Celery
 _mongo_client = None
 _mongo_db = None
@@ -48,6 +100,32 @@ def get_col_pendientes():
     """Obtener colección de dominios pendientes de procesar"""
     return get_db()["dominios_pendientes"]
 
+def get_col_subdominios():
+    return get_db()["dominios_subdominios"]
+
+def get_col_cache_dns():
+    return get_db()["cache_dns"]
+
+def get_col_cache_asn():
+    return get_db()["cache_asn"]
+
+def get_col_stats():
+    return get_db()["worker_stats"]
+
+def get_col_reparto():
+    """Coordinación de los dominios repartidos en bloques (fan-out)"""
+    return get_db()["reparto_subdominios"]
+
+def get_col_ip_info():
+    return get_db()["ip_info"]
+
+def get_col_cache_enumeracion():
+    return get_db()["cache_enumeracion"]
+
+def get_col_circuitos():
+    """Estado compartido de los cortocircuitos de servicios externos"""
+    return get_db()["circuitos"]
+
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
 app = Celery("tasks", broker=CELERY_BROKER_URL)
 
@@ -56,7 +134,12 @@ app.conf.task_routes = {
     'tasks.procesar_dominio': {'queue': 'main_queue'},
     'tasks.distribuir_dominios': {'queue': 'main_queue'},
     'tasks.procesar_dominio_individual': {'queue': 'main_queue'},
-    'tasks.worker_loop': {'queue': 'main_queue'}
+    'tasks.worker_loop': {'queue': 'main_queue'},
+    'tasks.recuperar_leases': {'queue': 'main_queue'},
+    'tasks.asignar_particiones': {'queue': 'main_queue'},
+    'tasks.planificar_revisitas': {'queue': 'main_queue'},
+    'tasks.resolver_bloque_subdominios': {'queue': 'main_queue'},
+    'tasks.agregar_subdominios': {'queue': 'main_queue'}
 }
 
 # Ensure both services start with same queue configuration
@@ -69,122 +152,219 @@ app.conf.beat_schedule = {
     'distribuir-cada-10-segundos': {
         'task': 'tasks.distribuir_dominios',
         'schedule': 10.0,
+    },
+    'recuperar-leases': {
+        'task': 'tasks.recuperar_leases',
+        'schedule': float(os.environ.get("REAPER_SEGUNDOS", "60")),
+    },
+    'asignar-particiones': {
+        'task': 'tasks.asignar_particiones',
+        'schedule': 60.0,
+    },
+    'planificar-revisitas': {
+        'task': 'tasks.planificar_revisitas',
+        'schedule': float(os.environ.get("REVISITA_PLANIFICAR_SEGUNDOS", "300")),
     }
     # monitor task removed
 }
 
 # -------------------------------------------------------------------
-# DNS resolver global
+# Índice GeoIP (se carga antes del fork y lo comparten todos los procesos)
 # -------------------------------------------------------------------
-_resolver = dns.resolver.Resolver()
-_resolver.timeout = 2
-_resolver.lifetime = 5
+indice_geoip = IndiceGeoIP.cargar()
 
 # -------------------------------------------------------------------
-# Carga rangos IP (solo códigos de país y continente)
+# Tabla ASN offline (pfx2as); whois en vivo solo como respaldo
 # -------------------------------------------------------------------
-rangos_ip = []
-if os.path.exists("/app/ip_rangos.csv"):
-    with open("/app/ip_rangos.csv", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rangos_ip = [
-            (
-                int(ipaddress.ip_address(r["start_ip"])),
-                int(ipaddress.ip_address(r["end_ip"])),
-                r["country"],
-                r["continent"]
-            )
-            for r in reader
-        ]
-    rangos_ip.sort(key=lambda x: x[0])
+tabla_asn = TablaASN.cargar()
+
+# Bloques CIDR ya consultados por whois (compartidos vía Mongo)
+cache_asn = CacheASN(get_col_cache_asn)
+
+@worker_process_init.connect
+def _cargar_cache_asn(**kwargs):
+    cache_asn.cargar()
 
 # -------------------------------------------------------------------
 # LRU caches: GeoIP y ASN
 # -------------------------------------------------------------------
 @lru_cache(maxsize=10000)
 def buscar_localizacion(ip_str: str) -> dict:
-    ip_int = int(ipaddress.ip_address(ip_str))
-    for start, end, country, continent in rangos_ip:
-        if start <= ip_int <= end:
-            return {"country": country, "continent": continent}
-    return {}
+    return indice_geoip.buscar(ip_str)
+
+def buscar_localizaciones(ips: list) -> list:
+    """Localización de muchas IPs en una sola búsqueda vectorizada"""
+    return indice_geoip.buscar_lote(ips)
+
+def obtener_asn_info_offline(ip_str: str):
+    """Info ASN sin consultas de red (tabla offline y cache de whois), o None"""
+    info = tabla_asn.buscar(ip_str)
+    if info is not None:
+        return info
+    return cache_asn.buscar(ip_str)
+
+# Whois en vivo tras un cortocircuito: si los servidores RIR fallan o limitan, se deja de llamar
+circuito_whois = Circuito("whois", get_col_circuitos if CIRCUITO_COMPARTIDO else None)
 
 @lru_cache(maxsize=4096)
-def obtener_asn_info(ip_str: str) -> dict:
+def _obtener_asn_info(ip_str: str) -> dict:
+    info = obtener_asn_info_offline(ip_str)
+    if info is not None:
+        return info
+    if not ASN_WHOIS_FALLBACK:
+        return {"error_asn": "IP sin prefijo en la tabla ASN offline"}
+    try:
+        if not ipaddress.ip_address(ip_str).is_global:
+            return {"error_asn": "IP privada o reservada"}
+    except ValueError as e:
+        return {"error_asn": str(e)}
+    if not circuito_whois.permitir():
+        raise CircuitoAbierto("whois")
     try:
         res = IPWhois(ip_str).lookup_whois()
-        return {
+        info = {
             "asn": res.get("asn"),
             "asn_cidr": res.get("asn_cidr"),
             "asn_desc": res.get("asn_desc"),
             "asn_country_code": res.get("asn_country_code")
         }
+    except IPDefinedError as e:
+        # Rango privado o reservado: no es un fallo del servicio ni cuenta como sonda
+        circuito_whois.liberar()
+        return {"error_asn": str(e)}
+    except (WhoisRateLimitError, HTTPRateLimitError) as e:
+        circuito_whois.abrir(motivo=str(e))
+        raise CircuitoAbierto("whois") from e
+    except Exception as e:
+        circuito_whois.fallo(str(e))
+        raise
+    circuito_whois.exito()
+    cache_asn.guardar(ip_str, info)
+    return info
+
+def obtener_asn_info(ip_str: str) -> dict:
+    # Los errores no pasan por el LRU y en ip_info caducan antes (IP_INFO_REFRESCO_ERROR_MINUTOS):
+    # la IP se vuelve a intentar cuando whois responda
+    try:
+        return _obtener_asn_info(ip_str)
+    except CircuitoAbierto:
+        return {"error_asn": "whois en pausa (circuito abierto)"}
     except Exception as e:
         return {"error_asn": str(e)}
 
 # -------------------------------------------------------------------
 # Resolver registros DNS (sin guardar vacíos)
 # -------------------------------------------------------------------
-def resolver_registros_dns(dominio: str) -> dict:
-    tipos = ["A", "MX", "NS", "TXT"]
-    resultados = {}
-    for t in tipos:
-        items = []
-        try:
-            answers = _resolver.resolve(dominio, t)
-            for r in answers:
-                if t == "A":
-                    ip = str(r)
-                    items.append({
-                        "ip": ip,
-                        **obtener_asn_info(ip),
-                        **buscar_localizacion(ip)
-                    })
-                elif t == "MX":
-                    ex = r.exchange.to_text().rstrip('.')
-                    pref = r.preference
-                    ips = []
-                    try:
-                        for mx in _resolver.resolve(ex, "A"):
-                            mip = str(mx)
-                            ips.append({
-                                "ip": mip,
-                                **obtener_asn_info(mip),
-                                **buscar_localizacion(mip)
-                            })
-                    except Exception:
-                        pass
-                    items.append({"exchange": ex, "preference": pref, "ips": ips})
-                elif t == "NS":
-                    host = r.to_text().rstrip('.')
-                    ns_ips = []
-                    try:
-                        for a in _resolver.resolve(host, "A"):
-                            ipns = str(a)
-                            ns_ips.append({
-                                "ip": ipns,
-                                **obtener_asn_info(ipns),
-                                **buscar_localizacion(ipns)
-                            })
-                    except Exception:
-                        pass
-                    items.append({"ns_host": host, "ips": ns_ips})
-                else:  # TXT
-                    txt = b" ".join(r.strings).decode(errors="ignore")
-                    items.append({"txt": txt})
-        except Exception:
-            pass
-
-        if items:
-            resultados[t] = items
-    return resultados
+cache_dns = CacheDNS(get_col_cache_dns) if CACHE_DNS_ACTIVA else None
+
+def estadisticas_cache_dns() -> dict:
+    """Contadores de aciertos/fallos de la cache DNS de este proceso"""
+    return cache_dns.estadisticas() if cache_dns is not None else {}
+
+def enriquecer_ip(ip: str) -> dict:
+    return {**obtener_asn_info(ip), **buscar_localizacion(ip)}
+
+def enriquecer_ip_offline(ip: str) -> dict:
+    asn = obtener_asn_info_offline(ip) or {"error_asn": "IP sin prefijo en la tabla ASN offline"}
+    return {**asn, **buscar_localizacion(ip)}
+
+# Info ASN/geo por IP en ip_info; los registros DNS solo guardan la IP
+ip_info = RegistroIPInfo(get_col_ip_info, enriquecer_ip, FUENTE_WHOIS)
+# Perfiles sin whois: solo tabla ASN offline y GeoIP (le sirve también la info con whois)
+ip_info_offline = RegistroIPInfo(get_col_ip_info, enriquecer_ip_offline, FUENTE_OFFLINE,
+                                 (FUENTE_OFFLINE, FUENTE_WHOIS))
+
+def _registrador_ip(perfil: dict):
+    return ip_info.registrar if perfil["whois"] else ip_info_offline.registrar
+
+def resolver_registros_dns(dominio: str, tipos: list = TIPOS_REGISTRO, registrar_ip=None,
+                           plazo: Plazo = None) -> dict:
+    """Registros del apex; con plazo, lo que no termina a tiempo se omite y la etapa "apex" queda truncada"""
+    async def _resolver():
+        motor = MotorResolucion(registrar_ip or ip_info.registrar, cache_dns, plazo=plazo)
+        registros = await motor.resolver_registros(dominio, tipos)
+        if motor.truncado:
+            plazo.truncar("apex")
+        return registros
+    return asyncio.run(_resolver())
+
+def comprobar_vida(dominio: str, plazo: Plazo = None) -> str:
+    """Estado del apex según la comprobación NS/SOA (ver MotorResolucion.comprobar_vida)"""
+    if not COMPROBAR_VIDA:
+        return ESTADO_ACTIVO
+    async def _comprobar():
+        return await MotorResolucion(ip_info.registrar, cache_dns, plazo=plazo).comprobar_vida(dominio)
+    return asyncio.run(_comprobar())
+
+def comprobar_vida_lote(dominios: list) -> dict:
+    """{dominio: estado} de varios apex comprobados a la vez"""
+    if not COMPROBAR_VIDA:
+        return {d: ESTADO_ACTIVO for d in dominios}
+    async def _comprobar():
+        motor = MotorResolucion(ip_info.registrar, cache_dns)
+        return await asyncio.gather(*(motor.comprobar_vida(d) for d in dominios))
+    return dict(zip(dominios, asyncio.run(_comprobar())))
+
+async def _esperar(tareas: list, plazo: Plazo = None, etapa: str = None):
+    """
+    Espera a las tareas dentro del plazo; las que siguen en curso al agotarse
+    se cancelan y la etapa queda truncada.
+    """
+    if not tareas:
+        return
+    hechas, pendientes = await asyncio.wait(tareas, timeout=plazo.restante() if plazo is not None else None)
+    if pendientes:
+        for tarea in pendientes:
+            tarea.cancel()
+        await asyncio.gather(*pendientes, return_exceptions=True)
+        plazo.truncar(etapa)
+    for tarea in hechas:
+        tarea.result()
+
+async def _detectar_wildcard(motor, dominio: str):
+    if WILDCARD_MODO == "off":
+        return None
+    return await motor.detectar_wildcard(dominio)
+
+async def _resolver_y_escribir(motor, escritor, sub: str, wildcard: dict = None, fuentes: list = None):
+    """Resuelve un subdominio y lo pasa al escritor (los del wildcard solo se cuentan)"""
+    dns_sub = await motor.resolver_subdominio(sub, wildcard)
+    if dns_sub is None:
+        escritor.contar_wildcard()
+        return
+    if not dns_sub:
+        return
+    doc = {"subdominio": sub, "dns": dns_sub}
+    if fuentes is not None:
+        doc["fuentes"] = fuentes
+    if escritor.agregar(doc):
+        await asyncio.to_thread(escritor.vaciar)
+
+def _agregar_entrada_wildcard(escritor, dominio: str, wildcard: dict, coincidencias: int):
+    """Entrada agrupada "*.apex" con las coincidencias del wildcard (modo colapsar)"""
+    if wildcard and coincidencias and WILDCARD_MODO == "colapsar":
+        escritor.agregar({
+            "subdominio": f"*.{dominio}",
+            "wildcard": True,
+            "coincidencias": coincidencias,
+            "dns": wildcard["dns"]
+        })
+
+async def _cerrar_escritor(escritor, dominio: str, wildcard: dict, completo: bool) -> dict:
+    """Añade la entrada agrupada del wildcard y cierra el escritor: resumen del apex"""
+    _agregar_entrada_wildcard(escritor, dominio, wildcard, escritor.coincidencias_wildcard)
+    return await asyncio.to_thread(escritor.finalizar, completo)
 
 
 # -------------------------------------------------------------------
 # Subfinder local 
 # -------------------------------------------------------------------
-def obtener_subdominios_local(domain: str, timeout: int = 300):
+cache_enumeracion = CacheEnumeracion(get_col_cache_enumeracion)
+
+def obtener_subdominios_local(domain: str, timeout: int = 300, plazo: Plazo = None):
     subs, errors = set(), []
+    if plazo is not None and plazo.restante() < timeout:
+        timeout = plazo.restante()
     try:
         proc = subprocess.run(
             ["subfinder", "-d", domain, "-silent"],
@@ -197,6 +377,8 @@ def obtener_subdominios_local(domain: str, timeout: int = 300):
                 subs.add(s)
     except subprocess.TimeoutExpired as e:
         errors.append(f"subfinder timeout tras {e.timeout}s")
+        if plazo is not None and plazo.agotado():
+            plazo.truncar("enumeracion")
     except subprocess.CalledProcessError as e:
         out = e.stderr or e.stdout or str(e)
         errors.append(f"subfinder error: {out}")
@@ -209,46 +391,424 @@ def obtener_subdominios_local(domain: str, timeout: int = 300):
     ]
     return filtered, errors
 
+def obtener_subdominios_lote(dominios: list, timeout: int = SUBFINDER_LOTE_TIMEOUT) -> dict:
+    """
+    Enumera varios dominios con una sola ejecución de subfinder (-dL, salida JSON).
+    Devuelve {dominio: {"subdominios": [...], "errores": [...]}}.
+    """
+    resultados = {d: {"subdominios": set(), "errores": []} for d in dominios}
+    errors = []
+    salida = ""
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", dir="/tmp", delete=False) as f:
+        f.write("\n".join(dominios) + "\n")
+        lista = f.name
+    try:
+        proc = subprocess.run(
+            ["subfinder", "-dL", lista, "-silent", "-oJ"],
+            capture_output=True, text=True,
+            timeout=timeout, check=True
+        )
+        salida = proc.stdout
+    except subprocess.TimeoutExpired as e:
+        errors.append(f"subfinder timeout tras {e.timeout}s")
+    except subprocess.CalledProcessError as e:
+        out = e.stderr or e.stdout or str(e)
+        errors.append(f"subfinder error: {out}")
+    except Exception as e:
+        errors.append(f"subfinder excepción: {e}")
+    finally:
+        os.unlink(lista)
+
+    # Un fallo del proceso afecta a todos los dominios del lote
+    if errors:
+        return {d: {"subdominios": [], "errores": list(errors)} for d in dominios}
+
+    for ln in salida.splitlines():
+        try:
+            registro = json.loads(ln)
+        except ValueError:
+            continue
+        s = str(registro.get("host", "")).strip().lower().rstrip(".")
+        apex = str(registro.get("input", "")).strip().lower().rstrip(".")
+        if not s:
+            continue
+        # Sin campo input, se asigna al apex más largo que lo contenga
+        candidatos = [apex] if apex in resultados else sorted(resultados, key=len, reverse=True)
+        for domain in candidatos:
+            if s.endswith(f".{domain}") or s == domain:
+                resultados[domain]["subdominios"].add(s)
+                break
+
+    return {
+        d: {"subdominios": sorted(r["subdominios"]), "errores": r["errores"]}
+        for d, r in resultados.items()
+    }
+
+async def _procesar_subdominios(dominio: str, fecha_consulta, subs: list = None,
+                               fuentes: dict = None, errores: list = None, perfil: dict = None,
+                               plazo: Plazo = None):
+    """
+    Resuelve los subdominios y los escribe por lotes en dominios_subdominios.
+    Con subs=None ejecuta los enumeradores del perfil en streaming y resuelve
+    cada nombre en cuanto aparece, solapando enumeración y resolución.
+
+    Devuelve (resumen, errores, reparto). Con fan-out activo solo se resuelven
+    aquí los primeros FANOUT_UMBRAL nombres; si hay más, el resumen es None y
+    `reparto` lleva la parte ya escrita y los subdominios restantes.
+    Por encima del tope del perfil se descartan los menos prioritarios (ver
+    perfiles.priorizar); en streaming solo pueden descartarse los que llegan
+    después de completar el cupo local.
+    Con plazo, la enumeración y las resoluciones en curso se cortan al
+    agotarse y el resultado parcial se guarda sin borrar escaneos anteriores.
+    """
+    perfil = perfil or obtener_perfil()[1]
+    motor = MotorResolucion(_registrador_ip(perfil), cache_dns, plazo=plazo)
+    escritor = EscritorSubdominios(get_col_subdominios, dominio, fecha_consulta)
+    wildcard = None
+    tope = perfil["max_subdominios"] or None
+    limite = FANOUT_UMBRAL if FANOUT_SUBDOMINIOS else None
+    if tope is not None:
+        limite = tope if limite is None else min(limite, tope)
+    excedentes = []
+    recortados = 0
+
+    if subs is None:
+        wildcard = await _detectar_wildcard(motor, dominio)
+        pendientes = set()
+        locales = 0
+
+        def al_encontrar(sub, _fuentes_parciales):
+            # Las fuentes se guardan al terminar la enumeración (fijar_fuentes)
+            nonlocal locales
+            if sub == dominio:
+                return
+            if limite is not None and locales >= limite:
+                excedentes.append(sub)
+                return
+            locales += 1
+            tarea = asyncio.ensure_future(_resolver_y_escribir(motor, escritor, sub, wildcard))
+            pendientes.add(tarea)
+            tarea.add_done_callback(pendientes.discard)
+
+        timeout = plazo.limitar(SUBFINDER_TIMEOUT) if plazo is not None else SUBFINDER_TIMEOUT
+        fuentes, errores = await enumerar_streaming(dominio, al_encontrar, perfil["enumeradores"], timeout)
+        if errores and plazo is not None and plazo.agotado():
+            plazo.truncar("enumeracion")
+        if not errores:
+            await asyncio.to_thread(cache_enumeracion.guardar, dominio, list(fuentes), fuentes)
+        if tope is not None and len(excedentes) > tope - locales:
+            recortados = len(excedentes) - (tope - locales)
+            excedentes = priorizar(excedentes, dominio)[:tope - locales]
+        await _esperar(list(pendientes), plazo, "subdominios")
+        repartir = set(excedentes)
+        await asyncio.to_thread(escritor.fijar_fuentes, {
+            sub: lista for sub, lista in fuentes.items() if sub != dominio and sub not in repartir
+        })
+    else:
+        subs = [sub for sub in subs if sub != dominio]
+        if tope is not None and len(subs) > tope:
+            recortados = len(subs) - tope
+            subs = priorizar(subs, dominio)[:tope]
+        if limite is not None and len(subs) > limite:
+            subs, excedentes = subs[:limite], subs[limite:]
+        if subs:
+            wildcard = await _detectar_wildcard(motor, dominio)
+        fuentes = fuentes or {}
+        await _esperar([
+            asyncio.ensure_future(_resolver_y_escribir(motor, escritor, sub, wildcard, fuentes.get(sub)))
+            for sub in subs
+        ], plazo, "subdominios")
+
+    errores = errores or []
+    truncado = plazo is not None and bool({"enumeracion", "subdominios"} & set(plazo.truncados))
+    if excedentes and plazo is not None and plazo.agotado():
+        # Sin tiempo para repartir el resto: se queda fuera
+        plazo.truncar("subdominios")
+        truncado = True
+        excedentes = []
+    if recortados:
+        logger.warning(f"✂️ {dominio}: {recortados} subdominios descartados por el tope del perfil")
+    if excedentes:
+        await asyncio.to_thread(escritor.vaciar)
+        return None, errores, {
+            "parcial": escritor.resumen(),
+            "excedentes": excedentes,
+            "fuentes": {sub: fuentes[sub] for sub in excedentes if sub in fuentes},
+            "wildcard": wildcard,
+            "recortados": recortados
+        }
+    # Un escaneo recortado o truncado no borra los subdominios de escaneos anteriores
+    resumen = await _cerrar_escritor(escritor, dominio, wildcard,
+                                     completo=not errores and not recortados and not truncado)
+    if recortados:
+        resumen["recortados"] = recortados
+    return resumen, errores, None
+
+def procesar_subdominios(dominio: str, fecha_consulta, enumeracion: dict = None,
+                         forzar_enumeracion: bool = False, perfil: dict = None, plazo: Plazo = None):
+    """
+    Enumera y resuelve los subdominios de un dominio, guardándolos en
+    dominios_subdominios: devuelve (resumen, errores, reparto).
+    Si se pasa una enumeración ya hecha (modo lote), solo se resuelve. Si no,
+    se reutiliza la enumeración cacheada del apex mientras esté vigente,
+    salvo que se fuerce una nueva.
+    """
+    if enumeracion is None and not forzar_enumeracion:
+        enumeracion = cache_enumeracion.obtener(dominio)
+        if enumeracion is not None:
+            logger.debug(f"♻️ Enumeración cacheada de {dominio} ({enumeracion['fecha']})")
+    elif enumeracion is not None and not enumeracion["errores"]:
+        cache_enumeracion.guardar(dominio, enumeracion["subdominios"], enumeracion.get("fuentes"))
+
+    if enumeracion is not None:
+        subs, errs, fuentes = enumeracion["subdominios"], enumeracion["errores"], enumeracion.get("fuentes")
+    elif SUBFINDER_STREAMING:
+        return asyncio.run(_procesar_subdominios(dominio, fecha_consulta, perfil=perfil, plazo=plazo))
+    else:
+        subs, errs = obtener_subdominios_local(dominio, plazo=plazo)
+        fuentes = None
+        if not errs:
+            cache_enumeracion.guardar(dominio, subs)
+    return asyncio.run(_procesar_subdominios(dominio, fecha_consulta, subs, fuentes, errs, perfil, plazo))
+
 # -------------------------------------------------------------------
 # Guardar en Mongo
 # -------------------------------------------------------------------
+# "subdominios" (lista embebida de versiones anteriores) se elimina de dominios_actuales;
+# el resto solo si el resultado no los trae (p. ej. un dominio que ha dejado de existir)
+CAMPOS_ELIMINABLES = ["subdominios", "dns", "subdominios_resumen", "errores_enumeracion", "truncado"]
+buffer_escritura = BufferEscritura(get_col_historico, get_col_actual, eliminar=CAMPOS_ELIMINABLES)
+
 def guardar_informacion(info: dict):
-    get_col_historico().insert_one(info)
-    clean = {k: v for k, v in info.items() if k != "_id"}
-    get_col_actual().update_one(
-        {"dominio": clean["dominio"]},
-        {"$set": clean},
-        upsert=True
-    )
+    """
+    Encola el resultado; se escribe en bloque al llenarse el buffer o pasado su plazo.
+    En el histórico solo se guarda una marca si nada cambió, o un delta respecto
+    al estado anterior (ver historico.preparar_entrada).
+    """
+    anterior = buffer_escritura.ultimo(info["dominio"])
+    if anterior is None:
+        anterior = get_col_actual().find_one({"dominio": info["dominio"]})
+    entrada = preparar_entrada(info, anterior, CAMPOS_ELIMINABLES)
+    return buffer_escritura.agregar(info, entrada)
+
+@worker_process_shutdown.connect
+def _vaciar_buffer_escritura(**kwargs):
+    buffer_escritura.vaciar()
+
+atexit.register(buffer_escritura.vaciar)
+
+# Próximo escaneo de cada dominio según la frecuencia de cambios de su histórico
+planificador = PlanificadorRevisitas(get_col_historico, get_db)
+
+# -------------------------------------------------------------------
+# Métricas del proceso (worker_stats): un upsert combinado cada pocos segundos
+# -------------------------------------------------------------------
+metricas = AgregadorMetricas(get_col_stats)
+
+@worker_process_shutdown.connect
+def _vaciar_metricas(**kwargs):
+    metricas.vaciar()
+
+atexit.register(metricas.vaciar)
 
 # -------------------------------------------------------------------
 # Tarea Celery
 # -------------------------------------------------------------------
 @app.task(bind=True, max_retries=2, default_retry_delay=60)
-def procesar_dominio(self, dominio: str, titular: str = "", identificacion: str = ""):
+def procesar_dominio(self, dominio: str, titular: str = "", identificacion: str = "",
+                     enumeracion: dict = None, forzar_enumeracion: bool = False, perfil: str = None,
+                     plazo=None):
+    """
+    Escanea un dominio con el perfil indicado (argumento, perfil del dominio
+    en dominios_pendientes o PERFIL_POR_DEFECTO; ver perfiles.py).
+
+    Todas las etapas comparten `plazo` (Plazo o segundos; por defecto
+    PLAZO_DOMINIO_SEGUNDOS). Lo que no cabe se cancela y el resultado parcial
+    se guarda con "truncado": [etapas cortadas].
+    """
+    plazo = Plazo.crear(plazo)
+    nombre_perfil, config = obtener_perfil(perfil)
     info = {
         "dominio": dominio,
         "titular": titular,
         "identificacion": identificacion,
-        "fecha_consulta": datetime.now(timezone.utc)
+        "fecha_consulta": datetime.now(timezone.utc),
+        "perfil": nombre_perfil
     }
+    metricas.incrementar(f"perfiles.{nombre_perfil}")
+
+    # Etapa previa: un apex sin zona solo deja un registro de estado
+    with metricas.medir("vida"):
+        info["estado_dns"] = comprobar_vida(dominio, plazo)
+    if info["estado_dns"] in ESTADOS_MUERTOS:
+        guardar_informacion(info)
+        return {"dominio": dominio, "repartido": False, "estado_dns": info["estado_dns"]}
+
+    # Etapa apex
+    with metricas.medir("apex"):
+        info["dns"] = resolver_registros_dns(dominio, config["tipos"], _registrador_ip(config), plazo)
+
+    if not config["enumerar"]:
+        # Sin enumeración se conserva el resumen del último escaneo que enumeró
+        anterior = get_col_actual().find_one({"dominio": dominio}, {"subdominios_resumen": 1})
+        if anterior and anterior.get("subdominios_resumen"):
+            info["subdominios_resumen"] = anterior["subdominios_resumen"]
+        _anotar_truncado(info, plazo)
+        with metricas.medir("guardado"):
+            guardar_informacion(info)
+        return {"dominio": dominio, "repartido": False, "estado_dns": info["estado_dns"]}
 
-    info["dns"] = resolver_registros_dns(dominio)
-    subs, errs = obtener_subdominios_local(dominio)
+    # Etapa de enumeración; los subdominios van a dominios_subdominios y en el
+    # apex solo queda el resumen
+    with metricas.medir("subdominios"):
+        resumen, errs, reparto = procesar_subdominios(
+            dominio, info["fecha_consulta"], enumeracion,
+            forzar_enumeracion or config["forzar_enumeracion"], config,
+            plazo.reservar(PLAZO_RESERVA_SEGUNDOS)
+        )
     if errs:
-        info["subdominios"] = [{"error": e} for e in errs]
-    else:
-        detalles = []
-        for sub in subs:
-            if sub == dominio:
-                continue
-            dns_sub = resolver_registros_dns(sub)
-            if dns_sub:
-                detalles.append({"subdominio": sub, "dns": dns_sub})
-        info["subdominios"] = detalles
+        info["errores_enumeracion"] = errs
+    _anotar_truncado(info, plazo)
+
+    if reparto is not None:
+        # Dominio grande: el resto se resuelve en bloques y agregar_subdominios cierra el resultado
+        bloques = _repartir_subdominios(info, reparto, completo=not errs and not reparto["recortados"])
+        logger.warning(f"🔀 {dominio}: {len(reparto['excedentes'])} subdominios repartidos en {bloques} bloques")
+        return {"dominio": dominio, "repartido": True, "estado_dns": info["estado_dns"]}
+
+    info["subdominios_resumen"] = resumen
+    with metricas.medir("guardado"):
+        guardar_informacion(info)
+    return {"dominio": dominio, "repartido": False, "estado_dns": info["estado_dns"]}
+
+def _anotar_truncado(info: dict, plazo: Plazo):
+    if plazo.truncados:
+        info["truncado"] = list(plazo.truncados)
+        metricas.incrementar("dominios_truncados")
+        logger.warning(f"⏱️ {info['dominio']}: plazo agotado en {', '.join(plazo.truncados)}")
+
+# -------------------------------------------------------------------
+# Reparto de dominios grandes entre el cluster (fan-out)
+# -------------------------------------------------------------------
+def _repartir_subdominios(info: dict, reparto: dict, completo: bool) -> int:
+    """
+    Guarda el estado del dominio en reparto_subdominios y lanza un group de
+    resolver_bloque_subdominios con los subdominios restantes. Cada bloque
+    suma su parte al documento; el último en terminar lanza la agregación.
+    Devuelve el número de bloques.
+    """
+    excedentes = reparto["excedentes"]
+    bloques = [excedentes[i:i + FANOUT_BLOQUE] for i in range(0, len(excedentes), FANOUT_BLOQUE)]
+    clave = f"{info['dominio']}|{info['fecha_consulta'].isoformat()}"
+    wildcard = reparto["wildcard"]
+    ahora = datetime.now(timezone.utc)
+    get_col_reparto().insert_one({
+        "_id": clave,
+        "info": info,
+        "pendientes": len(bloques),
+        "total": reparto["parcial"]["total"],
+        "wildcard_coincidencias": reparto["parcial"]["wildcard_coincidencias"],
+        "hashes": [reparto["parcial"]["hash"]],
+        "errores_escritura": 0,
+        "recortados": reparto["recortados"],
+        "truncados": 0,
+        "wildcard": {"ips": sorted(wildcard["ips"]), "dns": wildcard["dns"]} if wildcard else None,
+        "completo": completo,
+        "creado": ahora,
+        "expira": ahora + timedelta(seconds=2 * FANOUT_LEASE_SEGUNDOS)
+    })
+    fuentes = reparto["fuentes"]
+    group(
+        resolver_bloque_subdominios.s(clave, bloque, {sub: fuentes[sub] for sub in bloque if sub in fuentes})
+        for bloque in bloques
+    ).apply_async()
+    return len(bloques)
+
+@app.task(bind=True, max_retries=3, default_retry_delay=30)
+def resolver_bloque_subdominios(self, clave: str, subdominios: list, fuentes: dict = None):
+    """Resuelve un bloque de subdominios de un dominio repartido y suma su parte"""
+    col_reparto = get_col_reparto()
+    reparto = col_reparto.find_one({"_id": clave}, {"info.dominio": 1, "info.fecha_consulta": 1, "wildcard": 1})
+    if reparto is None:
+        # Caducado o ya agregado
+        return 0
+    dominio = reparto["info"]["dominio"]
+    wildcard = reparto.get("wildcard")
+    if wildcard:
+        wildcard = {"ips": set(wildcard["ips"]), "dns": wildcard["dns"]}
+    fuentes = fuentes or {}
+    escritor = EscritorSubdominios(get_col_subdominios, dominio, reparto["info"]["fecha_consulta"])
+
+    plazo = Plazo(PLAZO_BLOQUE_SEGUNDOS)
+
+    async def _resolver():
+        motor = MotorResolucion(ip_info.registrar, cache_dns, plazo=plazo)
+        await _esperar([
+            asyncio.ensure_future(_resolver_y_escribir(motor, escritor, sub, wildcard, fuentes.get(sub)))
+            for sub in subdominios
+        ], plazo, "subdominios")
+
+    try:
+        with metricas.medir("bloque_subdominios"):
+            asyncio.run(_resolver())
+            escritor.vaciar()
+    except Exception as e:
+        raise self.retry(exc=e)
 
+    parte = escritor.resumen()
+    estado = col_reparto.find_one_and_update(
+        {"_id": clave},
+        {"$inc": {
+            "pendientes": -1,
+            "total": parte["total"],
+            "wildcard_coincidencias": parte["wildcard_coincidencias"],
+            "errores_escritura": escritor.errores,
+            "truncados": 1 if plazo.truncados else 0
+         },
+         "$push": {"hashes": parte["hash"]}},
+        projection={"pendientes": 1},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    if estado is not None and estado["pendientes"] == 0:
+        agregar_subdominios.delay(clave)
+    return parte["total"]
+
+@app.task
+def agregar_subdominios(clave: str):
+    """Última etapa del reparto: resumen de subdominios, resultado del apex y cierre del dominio"""
+    col_reparto = get_col_reparto()
+    reparto = col_reparto.find_one({"_id": clave})
+    if reparto is None:
+        return None
+    info = reparto["info"]
+    dominio = info["dominio"]
+    completo = reparto["completo"] and not reparto["errores_escritura"] and not reparto.get("truncados")
+
+    # Entrada del wildcard y limpieza de subdominios de escaneos anteriores
+    with metricas.medir("agregacion"):
+        escritor = EscritorSubdominios(get_col_subdominios, dominio, info["fecha_consulta"])
+        _agregar_entrada_wildcard(escritor, dominio, reparto.get("wildcard"), reparto["wildcard_coincidencias"])
+        final = escritor.finalizar(completo)
+
+    info["subdominios_resumen"] = {
+        "total": reparto["total"] + final["total"],
+        "wildcard_coincidencias": reparto["wildcard_coincidencias"],
+        "hash": combinar_hashes(reparto["hashes"] + [final["hash"]])
+    }
+    if reparto.get("recortados"):
+        info["subdominios_resumen"]["recortados"] = reparto["recortados"]
+    if reparto.get("truncados") and "subdominios" not in info.get("truncado", []):
+        # Algún bloque se quedó sin tiempo
+        info["truncado"] = info.get("truncado", []) + ["subdominios"]
     guardar_informacion(info)
-    return f"Procesado: {dominio}"
+    buffer_escritura.vaciar()
+
+    fecha = info["fecha_consulta"].replace(tzinfo=timezone.utc)
+    _marcar_procesado(dominio, (datetime.now(timezone.utc) - fecha).total_seconds(),
+                      info.get("estado_dns"))
+    col_reparto.delete_one({"_id": clave})
+    logger.warning(f"✅ {dominio} agregado: {info['subdominios_resumen']['total']} subdominios")
+    return info["subdominios_resumen"]["total"]
 
 # -------------------------------------------------------------------
 # Worker loop para dominios pendientes
@@ -264,117 +824,207 @@ def worker_loop():
     # Exit - this task only needs to run once at startup
     return "Distribuidor iniciado correctamente"
 
+def _marcar_procesado(dominio: str, segundos: float, estado_dns: str = None):
+    """
+    Cierra el dominio para main y programa su revisita (main_next_scan_at).
+    El estado DNS queda en el pendiente para que los colectores no pierdan
+    tiempo con dominios muertos, que se revisitan pasados
+    DOMINIO_MUERTO_REVISITA_DIAS (DOMINIO_SERVFAIL_REVISITA_HORAS si es un
+    servfail); el resto según planificador.
+    El cierre espera a que el buffer haya escrito el resultado: si el proceso
+    muere antes, el dominio sigue reclamado y el recolector de leases lo
+    devuelve a la cola.
+    """
+    ahora = datetime.now(timezone.utc)
+    cambios = {
+        "procesado_por.main": True,
+        "procesado_por.completed_at": ahora,
+        "procesado_por.processing_time": segundos
+    }
+    eliminar = {"forzar_enumeracion": "",
+                "procesado_por.main_lease": "",
+                "procesado_por.main_lease_hasta": "",
+                "procesado_por.main_proximo_intento": ""}
+    if estado_dns is not None:
+        cambios["estado_dns"] = estado_dns
+        cambios["estado_dns_fecha"] = ahora
+
+    def cerrar():
+        if estado_dns == ESTADO_SERVFAIL:
+            cambios["procesado_por.main_next_scan_at"] = ahora + timedelta(hours=DOMINIO_SERVFAIL_REVISITA_HORAS)
+        elif estado_dns in ESTADOS_MUERTOS:
+            cambios["procesado_por.main_next_scan_at"] = ahora + timedelta(days=DOMINIO_MUERTO_REVISITA_DIAS)
+        else:
+            # Ya con la entrada de este escaneo en dominios_historico
+            cambios["procesado_por.main_next_scan_at"] = planificador.siguiente(dominio, ahora)
+        # Con la conexión del proceso: la del llamante puede estar cerrada cuando se vacíe el buffer
+        get_col_pendientes().update_one({"dominio": dominio}, {"$set": cambios, "$unset": eliminar})
+
+    buffer_escritura.despues_de_escribir(dominio, cerrar)
+
+def _procesar_reclamado(col_pendientes, worker_id, domain_doc, enumeracion=None, reclamador=None):
+    """Procesa un dominio ya reclamado y actualiza su estado y las estadísticas"""
+    dominio = domain_doc["dominio"]
+    titular = domain_doc.get("titular", "")
+    identificacion = domain_doc.get("identificacion", "")
+    
+    # Change to debug level - only seen when needed
+    logger.debug(f"🔹 Worker {worker_id} reclamó dominio: {dominio}")
+    
+    metricas.incrementar("dominios_reclamados")
+    
+    start_time = datetime.now(timezone.utc)
+    try:
+        # Change to debug - reduce log noise
+        logger.debug(f"▶️ Worker {worker_id} inicia procesamiento: {dominio}")
+        resultado = procesar_dominio(
+            dominio, titular, identificacion,
+            enumeracion=enumeracion,
+            forzar_enumeracion=domain_doc.get("forzar_enumeracion", False),
+            perfil=domain_doc.get("perfil")
+        )
+        
+        metricas.observar("dominio", (datetime.now(timezone.utc) - start_time).total_seconds())
+        if resultado["repartido"]:
+            # Lo cierra agregar_subdominios; el lease se alarga para cubrir los bloques en vuelo
+            col_pendientes.update_one(
+                {"_id": domain_doc["_id"],
+                 "procesado_por.main_lease": domain_doc.get("procesado_por", {}).get("main_lease")},
+                {"$set": {"procesado_por.main_lease_hasta":
+                          datetime.now(timezone.utc) + timedelta(seconds=FANOUT_LEASE_SEGUNDOS)}}
+            )
+            metricas.incrementar("dominios_repartidos")
+            return
+        
+        # Mark as processed
+        _marcar_procesado(dominio, (datetime.now(timezone.utc) - start_time).total_seconds(),
+                          resultado["estado_dns"])
+        
+        metricas.incrementar("dominios_procesados")
+        if resultado["estado_dns"] in ESTADOS_MUERTOS:
+            metricas.incrementar(f"dominios_{resultado['estado_dns']}")
+        metricas.incrementar("tiempo_total_segundos", (datetime.now(timezone.utc) - start_time).total_seconds())
+        
+        # Keep completion logs as they're useful for monitoring performance
+        # But simplify the format
+        logger.warning(f"✅ {dominio} completado en {(datetime.now(timezone.utc) - start_time).total_seconds():.2f}s")
+    except Exception as e:
+        # Keep error logs
+        logger.error(f"❌ Error en {dominio}: {str(e)}")
+        metricas.incrementar("dominios_error")
+        # Reintento con espera exponencial (o dead-letter tras REINTENTOS_MAX)
+        if reclamador is not None:
+            reclamador.fallo(domain_doc, str(e))
+    finally:
+        if reclamador is not None:
+            reclamador.liberar(domain_doc["_id"])
+
+def _enumerar_reclamados(reclamados: list) -> dict:
+    """
+    Modo lote: enumera con una sola ejecución de subfinder (por grupos de
+    SUBFINDER_LOTE) los dominios reclamados sin enumeración cacheada vigente.
+    Los apex muertos se descartan antes para no enumerarlos, igual que los de
+    perfiles sin enumeración o con enumeradores propios (el lote solo usa subfinder).
+    """
+    if SUBFINDER_LOTE <= 1:
+        return {}
+    sin_cache = []
+    for d in reclamados:
+        perfil = obtener_perfil(d.get("perfil"))[1]
+        if not perfil["enumerar"] or perfil["forzar_enumeracion"]:
+            continue
+        if d.get("forzar_enumeracion") or cache_enumeracion.obtener(d["dominio"]) is None:
+            sin_cache.append(d["dominio"])
+    if not sin_cache:
+        return {}
+    estados = comprobar_vida_lote(sin_cache)
+    sin_cache = [d for d in sin_cache if estados[d] not in ESTADOS_MUERTOS]
+    enumeraciones = {}
+    for i in range(0, len(sin_cache), SUBFINDER_LOTE):
+        grupo = sin_cache[i:i + SUBFINDER_LOTE]
+        if len(grupo) > 1:
+            enumeraciones.update(obtener_subdominios_lote(grupo))
+    return enumeraciones
+
+def _actualizar_heartbeat():
+    metricas.establecer("last_heartbeat", datetime.now(timezone.utc))
+    metricas.establecer("cache_dns", estadisticas_cache_dns())
+    metricas.establecer("circuitos", {circuito_whois.nombre: circuito_whois.estadisticas()})
+    metricas.establecer("resolvers", estadisticas_resolvers())
+    metricas.incrementar("heartbeat_count")
+
+# Reparto de particiones de este proceso (se crea tras el fork, con su worker_id)
+_asignacion_particiones = None
+
+def _obtener_asignacion(col_stats, worker_id):
+    global _asignacion_particiones
+    if not RECLAMO_PARTICIONADO:
+        return None
+    if _asignacion_particiones is None:
+        _asignacion_particiones = AsignacionParticiones(col_stats, worker_id)
+    return _asignacion_particiones
+
 @app.task
 def distribuir_dominios():
-    """Versión simplificada que permite a múltiples workers procesar dominios sin conflictos"""
+    """
+    Reclama dominios por lotes con lease y los procesa desde una cola local
+    con MAIN_PARALELISMO hilos. La cola se rellena en cuanto hay huecos, los
+    leases se renuevan mientras hay trabajo en curso y la pasada termina al
+    vaciarse la cola de pendientes o tras DISTRIBUIR_MAX_SEGUNDOS.
+    """
     client = None
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
     try:
         client = pymongo.MongoClient(MONGO_URI)
         db = client["dominios_db"]
         col_pendientes = db["dominios_pendientes"]
-        col_stats = db["worker_stats"]
         
-        # Check if we're already processing a domain
-        worker_id = f"{socket.gethostname()}:{os.getpid()}"
-        in_progress = col_pendientes.count_documents({
-            "procesado_por.main": {"$ne": True},
-            "procesado_por.main_iniciado": {"$exists": True},
-            "procesado_por.worker_id": worker_id
-        })
-        
-        # Only claim new domain if we're not busy
-        if in_progress == 0:
-            # Intentar reclamar exactamente un dominio de forma atómica
-            current_time = datetime.now(timezone.utc)
-            domain_doc = col_pendientes.find_one_and_update(
-                {
-                    "procesado_por.main": {"$ne": True}, 
-                    "procesado_por.main_iniciado": {"$exists": False}
-                },
-                {"$set": {
-                    "procesado_por.main_iniciado": current_time,
-                    "procesado_por.worker_id": worker_id
-                }},
-                sort=[("_id", 1)],
-                return_document=pymongo.ReturnDocument.AFTER
-            )
-            
-            if domain_doc:
-                dominio = domain_doc["dominio"]
-                titular = domain_doc.get("titular", "")
-                identificacion = domain_doc.get("identificacion", "")
-                
-                # Change to debug level - only seen when needed
-                logger.debug(f"🔹 Worker {worker_id} reclamó dominio: {dominio}")
-                
-                # Update statistics for this worker
-                col_stats.update_one(
-                    {"_id": worker_id},
-                    {"$inc": {"dominios_reclamados": 1}}
-                )
-                
-                start_time = datetime.now(timezone.utc)
-                try:
-                    # Change to debug - reduce log noise
-                    logger.debug(f"▶️ Worker {worker_id} inicia procesamiento: {dominio}")
-                    procesar_dominio(dominio, titular, identificacion)
-                    
-                    # Mark as processed
-                    col_pendientes.update_one(
-                        {"dominio": dominio},
-                        {"$set": {
-                            "procesado_por.main": True,
-                            "procesado_por.completed_at": datetime.now(timezone.utc),
-                            "procesado_por.processing_time": (datetime.now(timezone.utc) - start_time).total_seconds()
-                        }}
-                    )
+        reclamador = ReclamadorLotes(
+            col_pendientes, "main", worker_id,
+            asignacion=_obtener_asignacion(get_col_stats(), worker_id),
+            robar=PARTICION_ROBAR
+        )
+        reclamador.iniciar_renovacion()
+        inicio = time.time()
+        ultimo_heartbeat = 0.0
+        procesados = 0
+        sin_pendientes = False
+        try:
+            with ThreadPoolExecutor(max_workers=MAIN_PARALELISMO) as pool:
+                en_vuelo = set()
+                while True:
+                    # Rellenar la cola local mientras haya huecos y tiempo
+                    if (not sin_pendientes and len(en_vuelo) < MAIN_PARALELISMO
+                            and time.time() - inicio < DISTRIBUIR_MAX_SEGUNDOS):
+                        reclamados = reclamador.reclamar()
+                        if not reclamados:
+                            sin_pendientes = True
+                        else:
+                            enumeraciones = _enumerar_reclamados(reclamados)
+                            for doc in reclamados:
+                                en_vuelo.add(pool.submit(
+                                    _procesar_reclamado, col_pendientes, worker_id, doc,
+                                    enumeraciones.get(doc["dominio"]), reclamador
+                                ))
                     
-                    col_stats.update_one(
-                        {"_id": worker_id},
-                        {"$inc": {
-                            "dominios_procesados": 1,
-                            "tiempo_total_segundos": (datetime.now(timezone.utc) - start_time).total_seconds()
-                        }}
-                    )
+                    if time.time() - ultimo_heartbeat >= HEARTBEAT_SEGUNDOS:
+                        _actualizar_heartbeat()
+                        ultimo_heartbeat = time.time()
                     
-                    # Keep completion logs as they're useful for monitoring performance
-                    # But simplify the format
-                    logger.warning(f"✅ {dominio} completado en {(datetime.now(timezone.utc) - start_time).total_seconds():.2f}s")
-                except Exception as e:
-                    # Keep error logs
-                    logger.error(f"❌ Error en {dominio}: {str(e)}")
-                    col_stats.update_one(
-                        {"_id": worker_id},
-                        {"$inc": {"dominios_error": 1}}
-                    )
-                
-                next_check = 1  # Check for another domain immediately
-            else:
-                # Check how many total pending domains exist
-                pending_count = col_pendientes.count_documents({
-                    "procesado_por.main": {"$ne": True}, 
-                    "procesado_por.main_iniciado": {"$exists": False}
-                })
-                
-                next_check = 10 if pending_count == 0 else 3
-        else:
-            # We're still processing a domain, check back later
-            next_check = 5
-            
-        # Update heartbeat for monitoring
-        col_stats.update_one(
-            {"_id": worker_id},
-            {"$set": {"last_heartbeat": datetime.now(timezone.utc)},
-             "$inc": {"heartbeat_count": 1},
-             "$setOnInsert": {"first_seen": datetime.now(timezone.utc)}},
-            upsert=True
-        )
-            
-        # Siempre programar la siguiente ejecución
+                    if not en_vuelo:
+                        break
+                    hechos, en_vuelo = wait(en_vuelo, timeout=HEARTBEAT_SEGUNDOS, return_when=FIRST_COMPLETED)
+                    procesados += len(hechos)
+        finally:
+            reclamador.detener_renovacion()
+        
+        _actualizar_heartbeat()
+        
+        # Sin pendientes: esperar antes de volver a mirar; si no, seguir enseguida
+        next_check = 10 if sin_pendientes and procesados == 0 else 1
         distribuir_dominios.apply_async(countdown=next_check)
         
     except Exception as e:
-        worker_id = f"{socket.gethostname()}:{os.getpid()}"
         logger.error(f"❌ Error en worker {worker_id}: {str(e)}")
         distribuir_dominios.apply_async(countdown=5)
     finally:
@@ -382,7 +1032,34 @@ def distribuir_dominios():
             client.close()
 
 @app.task
-def procesar_dominio_individual(dominio, titular="", identificacion=""):
+def recuperar_leases():
+    """Devuelve a la cola las reclamaciones caducadas de todas las herramientas"""
+    try:
+        return recuperar_reclamaciones(get_col_pendientes(), get_col_stats())
+    except Exception as e:
+        logger.error(f"❌ Error recuperando reclamaciones caducadas: {e}")
+        return {}
+
+@app.task
+def asignar_particiones():
+    """Asigna partición a los dominios pendientes importados sin ella"""
+    try:
+        return rellenar_particiones(get_col_pendientes())
+    except Exception as e:
+        logger.error(f"❌ Error asignando particiones: {e}")
+        return 0
+
+@app.task
+def planificar_revisitas():
+    """Programa y reabre las revisitas de los dominios terminados por cada herramienta"""
+    try:
+        return _planificar_revisitas(get_col_pendientes(), planificador)
+    except Exception as e:
+        logger.error(f"❌ Error planificando revisitas: {e}")
+        return {}
+
+@app.task
+def procesar_dominio_individual(dominio, titular="", identificacion="", perfil=None):
     """Procesa un único dominio y actualiza su estado"""
     worker_id = f"{socket.gethostname()}:{os.getpid()}"
     start_time = datetime.now(timezone.utc)
@@ -393,12 +1070,11 @@ def procesar_dominio_individual(dominio, titular="", identificacion=""):
         client = pymongo.MongoClient(MONGO_URI)
         db = client["dominios_db"]
         col_pendientes = db["dominios_pendientes"]
-        col_stats = db["worker_stats"]
         
         # Check if domain is still valid to process
         domain_status = col_pendientes.find_one(
             {"dominio": dominio},
-            {"procesado_por": 1}
+            {"procesado_por": 1, "perfil": 1}
         )
         
         # Skip if already processed
@@ -417,26 +1093,19 @@ def procesar_dominio_individual(dominio, titular="", identificacion=""):
             return None  # Skip processing - let the claiming worker handle it
         
         # Process the domain
-        procesar_dominio(dominio, titular, identificacion)
+        resultado = procesar_dominio(dominio, titular, identificacion,
+                                     perfil=perfil or domain_status.get("perfil"))
+        if resultado["repartido"]:
+            # Lo marca como procesado agregar_subdominios
+            return None
         
         # Mark as processed
-        col_pendientes.update_one(
-            {"dominio": dominio},
-            {"$set": {
-                "procesado_por.main": True,
-                "procesado_por.completed_at": datetime.now(timezone.utc),
-                "procesado_por.processing_time": (datetime.now(timezone.utc) - start_time).total_seconds()
-            }}
-        )
+        _marcar_procesado(dominio, (datetime.now(timezone.utc) - start_time).total_seconds(),
+                          resultado["estado_dns"])
         
         # Update worker statistics
-        col_stats.update_one(
-            {"_id": worker_id},
-            {"$inc": {
-                "dominios_procesados": 1,
-                "tiempo_total_segundos": (datetime.now(timezone.utc) - start_time).total_seconds()
-            }}
-        )
+        metricas.incrementar("dominios_procesados")
+        metricas.incrementar("tiempo_total_segundos", (datetime.now(timezone.utc) - start_time).total_seconds())
         
         logger.warning(f"✅ Worker {worker_id} completó dominio: {dominio} en {(datetime.now(timezone.utc) - start_time).total_seconds():.2f}s")
         
@@ -444,11 +1113,7 @@ def procesar_dominio_individual(dominio, titular="", identificacion=""):
         logger.error(f"❌ Worker {worker_id} error en {dominio}: {str(e)}")
         
         # Update error statistics
-        if 'col_stats' in locals():
-            col_stats.update_one(
-                {"_id": worker_id},
-                {"$inc": {"dominios_error": 1}}
-            )
+        metricas.incrementar("dominios_error")
     finally:
         if 'client' in locals():
             client.close()
@@ -0,0 +1,9 @@
+from pathlib import Path
+
+import circuito
+
+
+def test_copia_de_opendata_identica():
+    original = Path(circuito.__file__).resolve()
+    copia = original.parents[1] / "collectors" / "opendata_service" / "circuito.py"
+    assert copia.read_bytes() == original.read_bytes()
@@ -0,0 +1,33 @@
+from escritura import EscritorSubdominios
+
+
+def _hash(docs: list) -> str:
+    escritor = EscritorSubdominios(None, "ejemplo.es", None)
+    for doc in docs:
+        escritor.agregar(doc)
+    return escritor.resumen()["hash"]
+
+
+def _doc(sub: str, ips: list, fuentes: list = None) -> dict:
+    doc = {"subdominio": sub, "dns": {"A": [{"ip": ip} for ip in ips]}}
+    if fuentes is not None:
+        doc["fuentes"] = fuentes
+    return doc
+
+
+def test_mismos_nombres_otras_fuentes_mismo_hash():
+    a = _hash([
+        _doc("www.ejemplo.es", ["192.0.2.1"], ["subfinder", "assetfinder"]),
+        _doc("mail.ejemplo.es", ["192.0.2.2"], ["subfinder"]),
+    ])
+    b = _hash([
+        _doc("mail.ejemplo.es", ["192.0.2.2"], ["assetfinder"]),
+        _doc("www.ejemplo.es", ["192.0.2.1"]),
+    ])
+    assert a == b
+
+
+def test_cambio_dns_cambia_hash():
+    a = _hash([_doc("www.ejemplo.es", ["192.0.2.1"], ["subfinder"])])
+    b = _hash([_doc("www.ejemplo.es", ["192.0.2.9"], ["subfinder"])])
+    assert a != b
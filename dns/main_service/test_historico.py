@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+from historico import hash_contenido, preparar_entrada, aplicar_diff, contenido, TIPO_SIN_CAMBIOS, TIPO_DELTA
+from resolucion import normalizar_respuesta
+
+
+def _info(ns: list, ips: list) -> dict:
+    return {
+        "dominio": "ejemplo.es",
+        "fecha_consulta": datetime.now(timezone.utc),
+        "dns": {
+            "A": [{"ip": ip} for ip in ips],
+            "NS": [{"ns_host": host, "ips": list(reversed(ips))} for host in ns],
+        },
+    }
+
+
+def test_respuestas_permutadas_mismo_hash():
+    a = _info(["ns1.ejemplo.es", "ns2.ejemplo.es"], ["192.0.2.1", "192.0.2.2"])
+    b = _info(["ns2.ejemplo.es", "ns1.ejemplo.es"], ["192.0.2.2", "192.0.2.1"])
+    assert hash_contenido(a) == hash_contenido(b)
+
+
+def test_respuestas_permutadas_sin_cambios():
+    anterior = _info(["ns1.ejemplo.es", "ns2.ejemplo.es"], ["192.0.2.1", "192.0.2.2"])
+    preparar_entrada(anterior)
+    nuevo = _info(["ns2.ejemplo.es", "ns1.ejemplo.es"], ["192.0.2.2", "192.0.2.1"])
+    assert preparar_entrada(nuevo, anterior)["tipo"] == TIPO_SIN_CAMBIOS
+
+
+def test_cambio_real_cambia_hash():
+    a = _info(["ns1.ejemplo.es"], ["192.0.2.1"])
+    b = _info(["ns1.ejemplo.es"], ["192.0.2.9"])
+    assert hash_contenido(a) != hash_contenido(b)
+
+
+def test_normalizar_respuesta_ordena():
+    assert normalizar_respuesta("A", ["192.0.2.2", "192.0.2.1"]) == ["192.0.2.1", "192.0.2.2"]
+
+
+def test_delta_ignora_campos_de_otros_procesos():
+    anterior = _info(["ns1.ejemplo.es"], ["192.0.2.1"])
+    preparar_entrada(anterior)
+    anterior["empresa"] = {"nif": "B00000000"}
+    nuevo = _info(["ns1.ejemplo.es"], ["192.0.2.9"])
+    entrada = preparar_entrada(nuevo, anterior, ["dns", "truncado"])
+    assert entrada["tipo"] == TIPO_DELTA
+    assert entrada["diff"]["unset"] == []
+    assert aplicar_diff(contenido(anterior), entrada["diff"])["dns"] == nuevo["dns"]
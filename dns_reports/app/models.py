@@ -5,6 +5,7 @@ import ssl
 import socket
 import OpenSSL
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -27,6 +28,82 @@ def get_col_historico():
     db = client.dominios_db
     return db.dominios_historico
 
+def get_col_subdominios():
+    """Conexión a la colección de subdominios por apex (solo lectura)"""
+    client = get_mongo_client()
+    db = client.dominios_db
+    return db.dominios_subdominios
+
+def get_col_ip_info():
+    """Conexión a la colección de info ASN/geo por IP (solo lectura)"""
+    client = get_mongo_client()
+    db = client.dominios_db
+    return db.ip_info
+
+# Cache en memoria de ip_info: {ip: (info, expira)}
+IP_INFO_CACHE_SEGUNDOS = int(os.getenv("IP_INFO_CACHE_SEGUNDOS", "600"))
+IP_INFO_CACHE_MAX = 50000
+_ip_info_cache = {}
+
+def get_ip_info(ips):
+    """Info ASN/geo de varias IPs ({ip: info}), con cache en memoria"""
+    ahora = time.time()
+    resultado, faltan = {}, []
+    for ip in set(ips):
+        entrada = _ip_info_cache.get(ip)
+        if entrada and entrada[1] > ahora:
+            resultado[ip] = entrada[0]
+        else:
+            faltan.append(ip)
+    if faltan:
+        if len(_ip_info_cache) > IP_INFO_CACHE_MAX:
+            _ip_info_cache.clear()
+        for doc in get_col_ip_info().find({"_id": {"$in": faltan}}, {"actualizado": 0}):
+            ip = doc.pop("_id")
+            resultado[ip] = doc
+            _ip_info_cache[ip] = (doc, ahora + IP_INFO_CACHE_SEGUNDOS)
+    return resultado
+
+def enrich_dns_records(dns_data):
+    """Completa las IPs de los registros DNS (A, AAAA, MX, NS) con su info de ip_info"""
+    if not isinstance(dns_data, dict):
+        return dns_data
+    registros = [r for tipo in ("A", "AAAA") for r in dns_data.get(tipo, []) if isinstance(r, dict)]
+    for tipo in ("MX", "NS"):
+        for r in dns_data.get(tipo, []):
+            if isinstance(r, dict):
+                registros += [ip for ip in r.get("ips", []) if isinstance(ip, dict)]
+    # Los documentos antiguos ya traen la info embebida
+    pendientes = [r for r in registros if "ip" in r and "asn" not in r]
+    info = get_ip_info([r["ip"] for r in pendientes])
+    for r in pendientes:
+        r.update(info.get(r["ip"], {}))
+    return dns_data
+
+def count_subdomains(domain_doc):
+    """Número de subdominios de un dominio (resumen o lista embebida antigua)"""
+    resumen = domain_doc.get("subdominios_resumen") or {}
+    if "total" in resumen:
+        return resumen["total"]
+    return len(domain_doc.get("subdominios") or [])
+
+def get_subdomains(domain_doc, page=1, per_page=50):
+    """
+    Página de subdominios de un dominio: (subdominios, total).
+    Los documentos antiguos los llevan embebidos; los nuevos en dominios_subdominios.
+    """
+    page = max(1, page)
+    inicio = (page - 1) * per_page
+    if "subdominios_resumen" not in domain_doc:
+        embebidos = domain_doc.get("subdominios") or []
+        return embebidos[inicio:inicio + per_page], len(embebidos)
+
+    col = get_col_subdominios()
+    filtro = {"apex": domain_doc["dominio"]}
+    total = col.count_documents(filtro)
+    cursor = col.find(filtro, {"_id": 0}).sort("subdominio", 1).skip(inicio).limit(per_page)
+    return list(cursor), total
+
 def sanitize_mongo_doc(doc):
     """Limpia documentos MongoDB para serialización JSON"""
     if doc is None:
@@ -120,11 +197,23 @@ def get_historical_trend(dominio, days=30):
             "dominio": dominio,
             "fecha_consulta": {"$gte": start_date, "$lte": end_date}
         }},
+        # Las entradas nuevas (completo/delta/sin_cambios) traen las métricas en "resumen";
+        # las antiguas guardan el documento entero
         {"$project": {
             "fecha": "$fecha_consulta",
-            "registros_dns": {"$size": {"$objectToArray": "$dns"}},
-            "tiene_ssl": {"$cond": [{"$ifNull": ["$ssl", False]}, True, False]},
-            "subdominios": {"$size": {"$ifNull": ["$subdominios", []]}},
+            "registros_dns": {"$ifNull": [
+                "$resumen.registros_dns",
+                {"$size": {"$objectToArray": {"$ifNull": ["$dns", {}]}}}
+            ]},
+            "tiene_ssl": {"$ifNull": [
+                "$resumen.tiene_ssl",
+                {"$cond": [{"$ifNull": ["$ssl", False]}, True, False]}
+            ]},
+            "subdominios": {"$ifNull": [
+                "$resumen.subdominios",
+                {"$size": {"$ifNull": ["$subdominios", []]}}
+            ]},
+            "sin_cambios": {"$eq": ["$tipo", "sin_cambios"]},
         }},
         {"$sort": {"fecha": 1}}
     ]
@@ -7,7 +7,8 @@ import json
 from bson import ObjectId
 from app.models import (get_col_actual, get_col_historico, 
                       get_specialized_data, get_historical_trend,
-                      search_domains, get_company_domains, get_mongo_client)
+                      search_domains, get_company_domains, get_mongo_client,
+                      get_subdomains, count_subdomains, enrich_dns_records)
 
 # Clase para manejar ObjectId en JSON
 class MongoJSONEncoder(json.JSONEncoder):
@@ -70,13 +71,29 @@ def domain_report(domain):
     else:
         domain_data['empresa'] = {'domicilio': {}}
     
+    # Subdominios paginados (colección dominios_subdominios)
+    page = request.args.get('page', 1, type=int)
+    per_page = 50
+    domain_data['subdominios'], subdomains_total = get_subdomains(domain_data, page, per_page)
+    
+    # Info ASN/geo de las IPs desde ip_info
+    enrich_dns_records(domain_data.get('dns'))
+    for sub in domain_data['subdominios']:
+        enrich_dns_records(sub.get('dns'))
+    pagination = {
+        'page': max(1, page),
+        'pages': max(1, -(-subdomains_total // per_page)),
+        'total': subdomains_total
+    }
+    
     # Enriquecer con datos especializados
     specialized = get_specialized_data(domain)
     
     return render_template('report.html',
                           report=domain_data,
                           specialized=specialized,
-                          domain=domain)
+                          domain=domain,
+                          pagination=pagination)
 
 @app.route('/company/<nif>')
 def company_profile(nif):
@@ -121,7 +138,7 @@ def company_profile(nif):
                 "fecha_consulta": doc.get("fecha_consulta", ""),
                 # Añadir más campos si están disponibles
                 "dns": doc.get("dns", {}),
-                "subdominios": doc.get("subdominios", [])
+                "subdominios_total": count_subdomains(doc)
             })
     
     return render_template('company.html', 
@@ -281,7 +298,10 @@ def dashboard():
         
         domains_with_company = col_actual.count_documents({"empresa": {"$exists": True}})
         domains_with_subdomains = col_actual.count_documents({
-            "subdominios": {"$exists": True, "$ne": []}
+            "$or": [
+                {"subdominios_resumen.total": {"$gt": 0}},
+                {"subdominios": {"$exists": True, "$ne": []}}
+            ]
         })
         
         # Contar empresas sin CNAE
@@ -340,16 +360,24 @@ def dashboard():
             # Paso 1: Desenrollar registros A
             {"$match": {"dns.A": {"$exists": True, "$ne": []}}},
             {"$unwind": "$dns.A"},
-            {"$match": {"dns.A.asn": {"$exists": True, "$ne": ""}}},
+            # Info de la IP desde ip_info (los documentos antiguos la traen embebida)
+            {"$lookup": {
+                "from": "ip_info",
+                "localField": "dns.A.ip",
+                "foreignField": "_id",
+                "as": "ip_info"
+            }},
+            {"$addFields": {"ip_info": {"$ifNull": [{"$arrayElemAt": ["$ip_info", 0]}, "$dns.A"]}}},
+            {"$match": {"ip_info.asn": {"$exists": True, "$ne": ""}}},
             
             # Paso 2: Agrupar por dominio y ASN para eliminar duplicados dentro del mismo dominio
             {"$group": {
                 "_id": {
                     "dominio": "$dominio",
-                    "asn": "$dns.A.asn"
+                    "asn": "$ip_info.asn"
                 },
-                "asn_desc": {"$first": "$dns.A.asn_desc"},
-                "country": {"$first": "$dns.A.country"}
+                "asn_desc": {"$first": "$ip_info.asn_desc"},
+                "country": {"$first": "$ip_info.country"}
             }},
             
             # Paso 3: Ahora agrupar por ASN contando dominios únicos
@@ -857,6 +885,9 @@ def get_domain_complete_data(domain):
     if not main_data:
         return None
     
+    # Info ASN/geo de las IPs desde ip_info
+    enrich_dns_records(main_data.get('dns'))
+    
     # Datos de certificados desde dominios_certgraph
     col_certgraph = db['dominios_certgraph']
     cert_data = col_certgraph.find_one({"dominio": domain})
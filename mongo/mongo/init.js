@@ -22,6 +22,27 @@ db.createCollection("dominios_empresa");  // Nueva colección para OpenData
 // Collection for pending domains
 db.createCollection("dominios_pendientes");
 
+// Shared DNS answer cache (main_service)
+db.createCollection("cache_dns");
+
+// Shared whois results keyed by CIDR block (main_service)
+db.createCollection("cache_asn");
+
+// Last subdomain enumeration per apex (main_service)
+db.createCollection("cache_enumeracion");
+
+// ASN and geo info per IP, referenced by the DNS records (main_service)
+db.createCollection("ip_info");
+
+// Coordination of large domains split into subdomain chunks (main_service)
+db.createCollection("reparto_subdominios");
+
+// Subdomains per apex, one document per (apex, subdominio) (main_service)
+db.createCollection("dominios_subdominios");
+
+// Shared circuit-breaker state for external services (whois, opendata)
+db.createCollection("circuitos");
+
 // Create indexes
 print("Creating indexes...");
 
@@ -33,6 +54,7 @@ db.dominios_actuales.createIndex({ "ips": 1 });
 // Indexes for dominios_historico
 db.dominios_historico.createIndex({ "dominio": 1 });
 db.dominios_historico.createIndex({ "fecha": 1 });
+db.dominios_historico.createIndex({ "dominio": 1, "fecha_consulta": -1 });
 
 // Indexes for tool collections
 db.dominios_lynx.createIndex({ "dominio": 1 }, { unique: true });
@@ -47,6 +69,37 @@ db.dominios_pendientes.createIndex({ "dominio": 1 }, { unique: true });
 db.dominios_pendientes.createIndex({ "procesado_por.main": 1 });
 db.dominios_pendientes.createIndex({ "procesado_por.lynx": 1 });
 db.dominios_pendientes.createIndex({ "procesado_por.certgraph": 1 });
-db.dominios_pendientes.createIndex({ "procesado_por.opendata": 1 });  
+db.dominios_pendientes.createIndex({ "procesado_por.opendata": 1 });
+// Lease claims (main_service): read-back by token and expiry scan
+db.dominios_pendientes.createIndex({ "procesado_por.main_lease": 1 }, { sparse: true });
+db.dominios_pendientes.createIndex({ "procesado_por.main_lease_hasta": 1 }, { sparse: true });
+// Partitioned claiming (RECLAMO_PARTICIONADO=1)
+db.dominios_pendientes.createIndex({ "particion": 1, "_id": 1 });  
+// Adaptive revisits: claim ordering and due-date scans by next_scan_at
+db.dominios_pendientes.createIndex({ "procesado_por.main": 1, "procesado_por.main_next_scan_at": 1 });
+db.dominios_pendientes.createIndex({ "procesado_por.lynx": 1, "procesado_por.lynx_next_scan_at": 1 });
+db.dominios_pendientes.createIndex({ "procesado_por.certgraph": 1, "procesado_por.certgraph_next_scan_at": 1 });
+db.dominios_pendientes.createIndex({ "procesado_por.opendata": 1, "procesado_por.opendata_next_scan_at": 1 });
+db.dominios_pendientes.createIndex({ "particion": 1, "procesado_por.main_next_scan_at": 1 });
+
+// Indexes for cache_dns (TTL: Mongo purges expired answers)
+db.cache_dns.createIndex({ "expira": 1 }, { expireAfterSeconds: 0 });
+
+// Indexes for cache_asn (TTL + incremental reload by update time)
+db.cache_asn.createIndex({ "expira": 1 }, { expireAfterSeconds: 0 });
+db.cache_asn.createIndex({ "actualizado": 1 });
+
+// Indexes for cache_enumeracion (TTL)
+db.cache_enumeracion.createIndex({ "expira": 1 }, { expireAfterSeconds: 0 });
+
+// Indexes for ip_info
+db.ip_info.createIndex({ "actualizado": 1 });
+
+// Indexes for reparto_subdominios (TTL: abandoned splits)
+db.reparto_subdominios.createIndex({ "expira": 1 }, { expireAfterSeconds: 0 });
+
+// Indexes for dominios_subdominios
+db.dominios_subdominios.createIndex({ "apex": 1, "subdominio": 1 }, { unique: true });
+db.dominios_subdominios.createIndex({ "apex": 1, "fecha_consulta": 1 });
 
 print("Database initialization complete - all collections and indexes created");
\ No newline at end of file